@@ -0,0 +1,83 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from audio_io import decode_audio, open_wav
+from audio_norm import resample, to_mono
+from durations import scan_durations
+
+MAX_CACHED = 32  # decoded clips kept in memory
+
+
+def load_clip(path, sampling_rate):
+    """
+    Mono float32 samples of an audio file at sampling_rate. WAV files are read directly and resampled in memory,
+    anything else is decoded and resampled by ffmpeg through a pipe.
+    """
+    try:
+        samples, file_rate = open_wav(path, mmap=False)
+    except ValueError:
+        samples, file_rate = decode_audio(path, sample_rate=sampling_rate, channels=1)
+    return resample(to_mono(samples), file_rate, sampling_rate)
+
+
+class AudioFolder:
+    """
+    Lazy view of the audio files of a folder. The file names are listed once (in name order) and clips are only
+    decoded and resampled to sampling_rate when accessed; the last max_cached decoded clips are kept in an LRU, so
+    memory does not grow with the size of the folder. stream() decodes the upcoming clips in background threads
+    while the caller works on the current one.
+    """
+
+    def __init__(self, folder, sampling_rate, extensions=(".wav",), max_cached=MAX_CACHED, workers=None):
+        self.folder = folder
+        self.sampling_rate = sampling_rate
+        self.files = sorted(file for file in os.listdir(folder) if file.lower().endswith(extensions))
+        self.paths = [os.path.join(folder, file) for file in self.files]
+        self.max_cached = max_cached
+        self.workers = workers or os.cpu_count() or 1
+        self._cached = OrderedDict()
+        self._lock = threading.Lock()
+        self._lengths = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def lengths(self):
+        """
+        Number of samples of every clip at sampling_rate, read from the file headers without decoding the audio.
+        """
+        if self._lengths is None:
+            durations = scan_durations(self.paths, workers=self.workers)
+            self._lengths = np.round(np.array(durations, dtype=np.float64) * self.sampling_rate).astype(np.int64)
+        return self._lengths
+
+    def __getitem__(self, i):
+        with self._lock:
+            if i in self._cached:
+                self._cached.move_to_end(i)
+                return self._cached[i]
+        array = load_clip(self.paths[i], self.sampling_rate)
+        with self._lock:
+            self._cached[i] = array
+            while len(self._cached) > self.max_cached:
+                self._cached.popitem(last=False)
+        return array
+
+    def stream(self, indices=None, prefetch=None):
+        """
+        Yields (index, samples) for every index of indices (every clip by default), in order. Up to prefetch
+        clips (twice the number of workers by default) are decoded ahead by a thread pool.
+        """
+        indices = iter(range(len(self)) if indices is None else indices)
+        prefetch = prefetch or 2 * self.workers
+        with ThreadPoolExecutor(max_workers=self.workers) as ex:
+            pending = deque((i, ex.submit(self.__getitem__, i)) for i in islice(indices, prefetch))
+            while pending:
+                i, future = pending.popleft()
+                pending.extend((j, ex.submit(self.__getitem__, j)) for j in islice(indices, 1))
+                yield i, future.result()
@@ -0,0 +1,154 @@
+import os
+import struct
+import subprocess
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from metrics import run_subprocess
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+WavInfo = namedtuple("WavInfo", ["sample_rate", "channels", "sample_width", "format_tag", "data_offset", "n_frames"])
+
+
+def read_wav_info(path) -> WavInfo:
+    """
+    Parses the RIFF/WAVE header of a file without reading the audio data.
+    Raises ValueError if the file is not a WAV file this module can map directly.
+    """
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ValueError("{0} is not a RIFF/WAVE file".format(path))
+        fmt = None
+        file_size = os.fstat(f.fileno()).st_size
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("{0} has no data chunk".format(path))
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("{0} has a data chunk before the fmt chunk".format(path))
+                data_offset = f.tell()
+                # Some writers (ffmpeg when piping) leave the size field at 0 or 0xFFFFFFFF
+                if chunk_size == 0 or data_offset + chunk_size > file_size:
+                    chunk_size = file_size - data_offset
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = struct.unpack("<H", fmt[24:26])[0]
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise ValueError("{0} uses unsupported WAV format tag {1}".format(path, hex(format_tag)))
+    sample_width = bits // 8
+    return WavInfo(sample_rate, channels, sample_width, format_tag, data_offset, chunk_size // block_align)
+
+
+def _dtype_for(info: WavInfo):
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if info.sample_width == 4:
+            return np.dtype("<f4")
+        if info.sample_width == 8:
+            return np.dtype("<f8")
+    elif info.sample_width == 1:
+        return np.dtype("u1")
+    elif info.sample_width == 2:
+        return np.dtype("<i2")
+    elif info.sample_width == 4:
+        return np.dtype("<i4")
+    raise ValueError("Unsupported sample width of {0} bytes".format(info.sample_width))
+
+
+def open_wav(path, mmap=True):
+    """
+    Returns a (frames, channels) array with the samples of the WAV file and its sample rate.
+    With mmap=True the array is a read-only memory map of the file, so slicing it only reads the
+    requested region from disk. Raises ValueError for files that cannot be mapped (compressed, 24 bit...).
+    """
+    info = read_wav_info(path)
+    dtype = _dtype_for(info)
+    shape = (info.n_frames, info.channels)
+    if mmap:
+        samples = np.memmap(path, dtype=dtype, mode="r", offset=info.data_offset, shape=shape)
+    else:
+        with open(path, "rb") as f:
+            f.seek(info.data_offset)
+            samples = np.fromfile(f, dtype=dtype, count=shape[0] * shape[1]).reshape(shape)
+    return samples, info.sample_rate
+
+
+def to_int16(samples):
+    """
+    Converts an array of samples of any supported dtype to 16 bit PCM.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        return samples
+    if samples.dtype == np.uint8:
+        return ((samples.astype(np.int16) - 128) << 8).astype(np.int16)
+    if samples.dtype == np.int32:
+        return (samples >> 16).astype(np.int16)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def write_wav(path, samples, sample_rate):
+    """
+    Writes a (frames,) or (frames, channels) array as a 16 bit PCM WAV file.
+    """
+    samples = to_int16(samples)
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    with wave.open(path, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(np.ascontiguousarray(samples).tobytes())
+
+
+def slice_seconds(samples, sample_rate, start, end):
+    """
+    Returns the samples between start and end (in seconds), clamped to the length of the audio.
+    """
+    first = max(0, int(round(start * sample_rate)))
+    last = min(len(samples), int(round(end * sample_rate)))
+    return samples[first:max(first, last)]
+
+
+def decode_audio(path, sample_rate=None, channels=None, audio_filter=None):
+    """
+    Returns a (frames, channels) int16 array with the decoded audio and its sample rate.
+    Plain WAV files without conversion are read directly, anything else is decoded by a single
+    ffmpeg process that pipes raw PCM to stdout, so no temporary files are written.
+    """
+    if sample_rate is None and channels is None and audio_filter is None:
+        try:
+            samples, file_sample_rate = open_wav(path, mmap=False)
+            return to_int16(samples).reshape(len(samples), -1), file_sample_rate
+        except ValueError:
+            pass
+    if sample_rate is None or channels is None:
+        try:
+            info = read_wav_info(path)
+            sample_rate = sample_rate or info.sample_rate
+            channels = channels or info.channels
+        except ValueError:
+            sample_rate = sample_rate or 22050
+            channels = channels or 1
+    command = ["ffmpeg", "-i", path, "-ac", str(channels), "-ar", str(sample_rate)]
+    if audio_filter:
+        command += ["-filter:a", audio_filter]
+    command += ["-f", "s16le", "-acodec", "pcm_s16le", "-", "-loglevel", "error", "-hide_banner"]
+    result = run_subprocess(command, stdout=subprocess.PIPE)
+    if result.returncode != 0:
+        raise ValueError("ffmpeg could not decode {0}".format(path))
+    return np.frombuffer(result.stdout, dtype="<i2").reshape(-1, channels), sample_rate
@@ -0,0 +1,106 @@
+import os
+import wave
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_io import decode_audio
+from audio_norm import normalize_array, TARGET_SAMPLE_RATE
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg")
+
+
+class JoinedAudio:
+    """
+    Several normalized audio files seen as one continuous mono 16 bit stream, without concatenating them.
+    Supports len() and slicing by sample index like a numpy array, so it can be passed anywhere the
+    cutting stage expects the samples of the source audio. It also keeps the offset of every source
+    file inside the stream, so any timestamp can be mapped back to the file it came from.
+    """
+
+    def __init__(self, chunks, sources, sample_rate=TARGET_SAMPLE_RATE):
+        self.chunks = chunks
+        self.sources = sources
+        self.sample_rate = sample_rate
+        self.offsets = [0]
+        for chunk in chunks:
+            self.offsets.append(self.offsets[-1] + len(chunk))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    @property
+    def duration(self):
+        return len(self) / self.sample_rate
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError("JoinedAudio only supports slicing")
+        first, last, _ = item.indices(len(self))
+        if last <= first:
+            return np.zeros(0, dtype=np.int16)
+        c_first = bisect_right(self.offsets, first) - 1
+        c_last = bisect_right(self.offsets, last - 1) - 1
+        parts = [self.chunks[c][max(first - self.offsets[c], 0):last - self.offsets[c]]
+                 for c in range(c_first, c_last + 1)]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def stream(self, block_size=1 << 20):
+        """
+        Yields the joined audio in blocks of at most block_size samples.
+        """
+        for chunk in self.chunks:
+            for i in range(0, len(chunk), block_size):
+                yield chunk[i:i + block_size]
+
+    def locate(self, seconds):
+        """
+        Returns (source file, seconds inside that file) for a timestamp of the joined stream.
+        """
+        sample = min(max(int(round(seconds * self.sample_rate)), 0), max(len(self) - 1, 0))
+        c = min(bisect_right(self.offsets, sample) - 1, len(self.chunks) - 1)
+        return self.sources[c], (sample - self.offsets[c]) / self.sample_rate
+
+    def write(self, path):
+        """
+        Streams the joined audio to a WAV file block by block.
+        """
+        with wave.open(path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            for block in self.stream():
+                w.writeframes(np.ascontiguousarray(block).tobytes())
+
+
+def decode_and_normalize(path, normalizer="ffmpeg"):
+    """
+    Returns the audio file as a normalized mono 22050 Hz int16 array. With normalizer="ffmpeg" a single
+    ffmpeg process decodes, resamples and applies speechnorm, piping the PCM back without temporary files.
+    """
+    if normalizer == "native":
+        samples, sample_rate = decode_audio(path)
+        return normalize_array(samples, sample_rate)
+    samples, _ = decode_audio(path, TARGET_SAMPLE_RATE, 1, "speechnorm=e=6")
+    return samples[:, 0]
+
+
+def list_audio_files(folder, exclude=()):
+    return sorted(os.path.join(folder, filename) for filename in os.listdir(folder)
+                  if filename.lower().endswith(AUDIO_EXTENSIONS) and filename not in exclude)
+
+
+def normalize_files(paths, normalizer="ffmpeg", workers=None):
+    """
+    Decodes and normalizes the files in parallel. Returns the int16 arrays in the order of paths.
+    """
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as ex:
+        return list(ex.map(lambda path: decode_and_normalize(path, normalizer), paths))
+
+
+def join_files(paths, normalizer="ffmpeg", workers=None) -> JoinedAudio:
+    """
+    Decodes and normalizes the files in parallel and joins them, in order, into a JoinedAudio stream.
+    """
+    return JoinedAudio(normalize_files(paths, normalizer, workers), list(paths))
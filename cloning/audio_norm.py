@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
+
+import numpy as np
+
+from audio_io import to_int16
+
+try:
+    from scipy.signal import resample_poly
+except ImportError:
+    print("Scipy not found, install it for polyphase resampling. Falling back to linear interpolation")
+    resample_poly = None
+
+TARGET_SAMPLE_RATE = 22050
+
+
+def to_mono(samples):
+    """
+    Downmixes a (frames,) or (frames, channels) array of any supported dtype to a float32 array in [-1, 1].
+    """
+    samples = np.asarray(samples)
+    if samples.dtype == np.uint8:
+        x = (samples.astype(np.float32) - 128) / 128
+    elif samples.dtype == np.int16:
+        x = samples.astype(np.float32) / 32768
+    elif samples.dtype == np.int32:
+        x = samples.astype(np.float32) / 2147483648
+    else:
+        x = samples.astype(np.float32)
+    if x.ndim == 2:
+        x = x.mean(axis=1) if x.shape[1] > 1 else x[:, 0]
+    return x
+
+
+def resample(x, orig_sr, target_sr):
+    """
+    Polyphase resampling of a mono float array from orig_sr to target_sr.
+    """
+    if orig_sr == target_sr or len(x) == 0:
+        return x
+    if resample_poly is not None:
+        g = gcd(orig_sr, target_sr)
+        return resample_poly(x, target_sr // g, orig_sr // g).astype(np.float32)
+    n_out = int(round(len(x) * target_sr / orig_sr))
+    return np.interp(np.arange(n_out) * (orig_sr / target_sr), np.arange(len(x)), x).astype(np.float32)
+
+
+def speechnorm(x, sample_rate, expansion=6.0, peak=0.95, raise_amount=0.001):
+    """
+    Vectorized equivalent of ffmpeg's speechnorm filter (speechnorm=e=6) with its default threshold.
+    The signal is split in half cycles between zero crossings and every half cycle is amplified towards
+    peak / (its own peak), never more than expansion. The gain drops immediately when a louder half cycle
+    arrives and rises at most raise_amount per half cycle, so
+        gain[k] = min(gain[k - 1] + raise_amount, target[k]),  gain[-1] = 1
+    which unrolls to gain[k] = raise_amount * k + min(1 + raise_amount, min_j<=k(target[j] - raise_amount * j)).
+    """
+    if len(x) == 0:
+        return x
+    max_period = max(1, sample_rate // 10)
+    crossings = np.flatnonzero(np.diff(np.signbit(x))) + 1
+    starts = np.union1d(np.concatenate(([0], crossings)), np.arange(0, len(x), max_period))
+    peaks = np.maximum.reduceat(np.abs(x), starts)
+    with np.errstate(divide="ignore"):
+        target = np.minimum(expansion, peak / peaks)
+    k = np.arange(len(starts), dtype=np.float64)
+    gain = raise_amount * k + np.minimum(1 + raise_amount, np.minimum.accumulate(target - raise_amount * k))
+    lengths = np.diff(np.append(starts, len(x)))
+    return (x * np.repeat(gain.astype(np.float32), lengths)).astype(np.float32)
+
+
+def normalize_array(samples, sample_rate, target_sr=TARGET_SAMPLE_RATE, expansion=6.0):
+    """
+    In-memory equivalent of utils.normalize_audio: mono, target_sr Hz, speechnorm and 16 bit PCM.
+    Returns the normalized int16 array, the sample rate is always target_sr.
+    """
+    x = resample(to_mono(samples), sample_rate, target_sr)
+    return to_int16(speechnorm(x, target_sr, expansion))
+
+
+def normalize_batch(buffers, sample_rates, target_sr=TARGET_SAMPLE_RATE, expansion=6.0, workers=None):
+    """
+    Normalizes a batch of buffers. sample_rates can be a list with one rate per buffer or a single rate.
+    Most of the work happens inside numpy/scipy, which release the GIL, so workers > 1 uses a thread pool.
+    """
+    if isinstance(sample_rates, int):
+        sample_rates = [sample_rates] * len(buffers)
+    if workers is None or workers <= 1:
+        return [normalize_array(b, sr, target_sr, expansion) for b, sr in zip(buffers, sample_rates)]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(lambda args: normalize_array(args[0], args[1], target_sr, expansion),
+                           zip(buffers, sample_rates)))
@@ -0,0 +1,445 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils import clean_batch, get_audio_length, multilingual_cleaners, normalize_audio
+
+SAMPLE_RATE = 22050
+BLOCK_LENGTH = 60  # seconds of synthetic audio rendered at once
+ENVELOPE_RATE = 100  # frames per second of the word envelope
+
+# Spanish-like words with accents, numbers and the symbols multilingual_cleaners has to deal with
+VOCABULARY = ["el", "la", "de", "que", "y", "en", "un", "una", "los", "las", "por", "con", "para", "como", "más",
+              "pero", "sus", "señor", "año", "también", "porque", "cuando", "muy", "sin", "sobre", "entre",
+              "España", "política", "económica", "sociedad", "futuro", "corazón", "canción", "niño", "pequeño",
+              "(aplausos)", "\"dijo\"", "[risas]", "bien;", "-", "así:", "2023", "¿verdad?", "¡claro!", "<eh>"]
+PUNCTUATION = ["", "", "", "", "", ",", ",", ";", ":"]
+ENDINGS = [".", ".", ".", "?", "!", "..."]
+
+PRESETS = {
+    "quick": {"words": [500, 10000], "minutes": [1, 5], "clips": 50, "repeat": 3},
+    "full": {"words": [500, 10000, 100000], "minutes": [10, 60, 180], "clips": 500, "repeat": 5},
+}
+
+# Word timeline of a synthetic recording: words[i] is spoken from starts[i] to ends[i] (seconds) and
+# sentences holds the index of the first word of every sentence plus len(words).
+Timeline = namedtuple("Timeline", ["words", "starts", "ends", "sentences"])
+
+
+def synthetic_timeline(n_words=None, duration=None, seed=0, mean_sentence_words=14) -> Timeline:
+    """
+    Random word timeline of n_words words or lasting about duration seconds: words of 0.15-0.6 s,
+    pauses of 0.05-0.25 s between words and 0.4-1.2 s between sentences. Sentence lengths follow a
+    geometric distribution, so some segments are longer than 10 seconds and have to be split.
+    """
+    rng = np.random.default_rng(seed)
+    if n_words is None:
+        n_words = int(duration / 0.55) + 1  # enough words, trimmed below
+    sentence_lengths = np.maximum(rng.geometric(1 / mean_sentence_words, n_words), 2)
+    sentences = np.concatenate([[0], np.cumsum(sentence_lengths)])
+    sentences = np.append(sentences[sentences < n_words], n_words)
+    lengths = rng.uniform(0.15, 0.6, n_words)
+    pauses = rng.uniform(0.05, 0.25, n_words)
+    pauses[sentences[1:-1]] = rng.uniform(0.4, 1.2, len(sentences) - 2)
+    pauses[0] = 0.5
+    starts = np.cumsum(pauses) + np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    ends = starts + lengths
+    words = [VOCABULARY[i] + PUNCTUATION[j] for i, j in
+             zip(rng.integers(0, len(VOCABULARY), n_words), rng.integers(0, len(PUNCTUATION), n_words))]
+    for last in sentences[1:] - 1:
+        words[last] = words[last].rstrip(",;:") + ENDINGS[last % len(ENDINGS)]
+    if duration is not None:
+        n_words = int(np.searchsorted(ends, duration - 0.5))
+        sentences = np.append(sentences[sentences < n_words], n_words)
+    return Timeline(words[:n_words], starts[:n_words], ends[:n_words], sentences)
+
+
+def synthetic_transcript(timeline: Timeline, missing_timestamps=0.002, seed=0) -> dict:
+    """
+    WhisperX-shaped result for a timeline: one segment per sentence with word timestamps and scores.
+    A fraction missing_timestamps of the words (whisperx does this with numbers) have no timestamps.
+    """
+    rng = np.random.default_rng(seed)
+    missing = rng.random(len(timeline.words)) < missing_timestamps
+    scores = rng.uniform(0.5, 1.0, len(timeline.words))
+    segments = []
+    for first, last in zip(timeline.sentences[:-1], timeline.sentences[1:]):
+        words = []
+        for i in range(first, last):
+            word = {"word": timeline.words[i]}
+            if not missing[i]:
+                word.update(start=round(float(timeline.starts[i]), 3), end=round(float(timeline.ends[i]), 3),
+                            score=round(float(scores[i]), 3))
+            words.append(word)
+        segments.append({"start": round(float(timeline.starts[first]), 3),
+                         "end": round(float(timeline.ends[last - 1]), 3),
+                         "text": " " + " ".join(timeline.words[first:last]), "words": words})
+    return {"segments": segments, "language": "es"}
+
+
+def word_envelope(timeline: Timeline, duration):
+    """
+    Amplitude envelope at ENVELOPE_RATE frames per second: syllable-rate (4 Hz) bumps inside the words, 0 in
+    the pauses.
+    """
+    n_frames = int(duration * ENVELOPE_RATE) + 1
+    inside = np.zeros(n_frames + 1)
+    np.add.at(inside, np.clip((timeline.starts * ENVELOPE_RATE).astype(int), 0, n_frames), 1)
+    np.add.at(inside, np.clip((timeline.ends * ENVELOPE_RATE).astype(int), 0, n_frames), -1)
+    t = np.arange(n_frames) / ENVELOPE_RATE
+    return (np.cumsum(inside)[:n_frames] > 0) * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t) ** 2)
+
+
+def write_synthetic_wav(path, timeline: Timeline, duration, sample_rate=SAMPLE_RATE, seed=0):
+    """
+    Renders a speech-like mono 16 bit WAV of duration seconds for the timeline: a harmonic voice with a slowly
+    gliding pitch, gated by the word envelope, over a low noise floor. Written block by block, so hour-long
+    files do not need to fit in memory.
+    """
+    rng = np.random.default_rng(seed)
+    envelope = word_envelope(timeline, duration)
+    n_samples = int(duration * sample_rate)
+    block = BLOCK_LENGTH * sample_rate
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        for i in range(0, n_samples, block):
+            t = np.arange(i, min(i + block, n_samples)) / sample_rate
+            # f0 glides between 120 and 180 Hz; the phase is the integral of the frequency, so blocks join smoothly
+            phase = 2 * np.pi * (150 * t - 30 / (2 * np.pi * 0.3) * np.cos(2 * np.pi * 0.3 * t))
+            voice = sum(np.sin(k * phase) / k for k in range(1, 5))
+            gain = envelope[np.minimum((t * ENVELOPE_RATE).astype(int), len(envelope) - 1)]
+            x = 0.25 * gain * voice + 0.003 * rng.standard_normal(len(t))
+            w.writeframes((np.clip(x, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+def write_synthetic_clips(folder, n_clips, sample_rate=SAMPLE_RATE, min_length=1.0, max_length=10.0, seed=0):
+    """
+    Writes n_clips short speech-like WAV files (1.wav, 2.wav...) of min_length to max_length seconds.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for k in range(n_clips):
+        duration = float(rng.uniform(min_length, max_length))
+        path = os.path.join(folder, "{0}.wav".format(k + 1))
+        write_synthetic_wav(path, synthetic_timeline(duration=duration, seed=seed + k), duration, sample_rate,
+                            seed + k)
+        paths.append(path)
+    return paths
+
+
+class StubFeatureExtractor:
+    """
+    Stand-in for the WavLM feature extractor: pads the arrays into a float tensor.
+    """
+
+    def __call__(self, arrays, sampling_rate=16000, return_tensors="pt", padding=True):
+        import torch
+        values = np.zeros((len(arrays), max(len(a) for a in arrays)), dtype=np.float32)
+        for k, a in enumerate(arrays):
+            values[k, :len(a)] = a
+        return StubInputs(input_values=torch.from_numpy(values))
+
+
+class StubInputs(dict):
+    def to(self, device):
+        return StubInputs({key: value.to(device) for key, value in self.items()})
+
+
+def stub_xvector(dim=512, frame=400, seed=0):
+    """
+    Stand-in for WavLMForXVector: a fixed random projection of the log magnitude of 25 ms frames, averaged over
+    time. Returns an object with .embeddings, like the model output, at a tiny fraction of the model cost.
+    """
+    import torch
+    projection = torch.from_numpy(np.random.default_rng(seed).standard_normal((frame, dim)).astype(np.float32))
+
+    def model(input_values, **kwargs):
+        n = input_values.shape[1] // frame
+        frames = input_values[:, :n * frame].reshape(len(input_values), n, frame)
+        return SimpleNamespace(embeddings=torch.log1p(frames.abs()).matmul(projection).mean(dim=1))
+
+    return model
+
+
+def measure(function, repeat=3, setup=None):
+    """
+    Runs function repeat times (with the arguments returned by setup(), if any, which is not timed) and
+    returns the times in seconds with their min, median and mean. Output of the function is silenced.
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup() if setup is not None else None) or ()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(*args)
+            times.append(time.perf_counter() - start)
+    return {"times": times, "min": min(times), "median": float(np.median(times)), "mean": float(np.mean(times))}
+
+
+def skipped(name, params, error):
+    return {"name": name, "params": params, "skipped": "{0}: {1}".format(type(error).__name__, error)}
+
+
+def result(name, params, timing, units=None, count=None):
+    entry = {"name": name, "params": params}
+    entry.update(timing)
+    if units is not None:
+        entry["throughput"] = {units + "_per_second": count / timing["min"] if timing["min"] > 0 else None}
+    return entry
+
+
+def bench_check_segments(words, repeat):
+    from transcribe_cut_long_audio import check_segments
+    for n_words in words:
+        segments = synthetic_transcript(synthetic_timeline(n_words, seed=n_words))["segments"]
+        yield result("check_segments", {"words": n_words}, measure(lambda: check_segments(segments), repeat),
+                     "words", n_words)
+
+
+def bench_cleaners(words, repeat):
+    for n_words in words:
+        texts = [segment["text"] for segment in
+                 synthetic_transcript(synthetic_timeline(n_words, seed=n_words))["segments"]]
+        # Cleared every run so the LRU cache of multilingual_cleaners does not turn the measure into lookups
+        yield result("multilingual_cleaners", {"words": n_words, "texts": len(texts)},
+                     measure(lambda: [multilingual_cleaners(text) for text in texts], repeat,
+                             multilingual_cleaners.cache_clear), "texts", len(texts))
+        yield result("clean_batch", {"words": n_words, "texts": len(texts)},
+                     measure(lambda: clean_batch(texts), repeat), "texts", len(texts))
+
+
+def bench_get_audio_length(work, clips, repeat):
+    from durations import scan_folder
+    folder = os.path.join(work, "lengths")
+    paths = write_synthetic_clips(folder, clips)
+    yield result("get_audio_length", {"files": clips},
+                 measure(lambda: [get_audio_length(path) for path in paths], repeat), "files", clips)
+    index_dir = os.path.join(work, "durations_index")
+    yield result("scan_folder", {"files": clips, "index": "cold"},
+                 measure(lambda: scan_folder(folder, index_dir=index_dir), repeat,
+                         lambda: shutil.rmtree(index_dir, ignore_errors=True)), "files", clips)
+    yield result("scan_folder", {"files": clips, "index": "warm"},
+                 measure(lambda: scan_folder(folder, index_dir=index_dir), repeat), "files", clips)
+
+
+def bench_normalize_audio(work, clips, repeat):
+    source = os.path.join(work, "normalize_source")
+    write_synthetic_clips(source, clips, sample_rate=44100)
+    target = os.path.join(work, "normalize")
+
+    def setup():
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target)
+        return [os.path.join(target, filename) for filename in os.listdir(target)],
+
+    for engine in ("ffmpeg", "native"):
+        params = {"files": clips, "engine": engine}
+        try:
+            timing = measure(lambda paths: [normalize_audio(path, engine) for path in paths], repeat, setup)
+        except OSError as e:  # ffmpeg not installed
+            yield skipped("normalize_audio", params, e)
+            continue
+        yield result("normalize_audio", params, timing, "files", clips)
+
+
+def bench_cut(work, minutes, repeat):
+    from transcribe_cut_long_audio import check_segments, cut_audio_and_generate_metadata
+    for length in minutes:
+        duration = length * 60.0
+        timeline = synthetic_timeline(duration=duration, seed=int(duration))
+        path = os.path.join(work, "long_{0}min.wav".format(length))
+        write_synthetic_wav(path, timeline, duration, seed=int(duration))
+        segments = check_segments(synthetic_transcript(timeline)["segments"])
+        out_folder = os.path.join(work, "cut")
+
+        def setup():
+            shutil.rmtree(out_folder, ignore_errors=True)
+            os.makedirs(os.path.join(out_folder, "wavs"))
+            return ()
+
+        for slicer, normalizer in (("native", "native"), ("native", "ffmpeg"), ("ffmpeg", "ffmpeg")):
+            params = {"minutes": length, "clips": len(segments), "slicer": slicer, "normalizer": normalizer}
+            try:
+                timing = measure(lambda: cut_audio_and_generate_metadata(out_folder, path, segments, slicer,
+                                                                         normalizer), repeat, setup)
+            except OSError as e:  # ffmpeg not installed
+                yield skipped("cut_audio_and_generate_metadata", params, e)
+                continue
+            yield result("cut_audio_and_generate_metadata", params, timing, "audio_seconds", duration)
+
+
+def bench_pipeline(work, minutes, repeat):
+    """
+    End to end run of transcribe_cut_long_audio.main with the transcription replaced by a stub backend that
+    returns the synthetic transcript. Also reports the per-stage wall time of the fastest run.
+    """
+    import transcribe_cut_long_audio
+    from metrics import PipelineMetrics
+    from transcription import TranscriptionBackend, register_backend
+
+    transcripts = dict()
+
+    @register_backend("synthetic")
+    class SyntheticBackend(TranscriptionBackend):
+        def transcribe(self, audio, content_hash=None) -> dict:
+            return json.loads(json.dumps(transcripts[audio]))
+
+    for length in minutes:
+        duration = length * 60.0
+        path = os.path.join(work, "long_{0}min.wav".format(length))
+        timeline = synthetic_timeline(duration=duration, seed=int(duration))
+        if not os.path.exists(path):
+            write_synthetic_wav(path, timeline, duration, seed=int(duration))
+        transcripts[path] = synthetic_transcript(timeline)
+        runs = []
+
+        def run():
+            metrics = PipelineMetrics()
+            transcribe_cut_long_audio.main(path, os.path.join(work, "pipeline"), backend="synthetic", cache_dir=None,
+                                           normalizer="native", metrics=metrics)
+            runs.append(metrics.report())
+
+        timing = measure(run, repeat)
+        fastest = runs[int(np.argmin(timing["times"]))]
+        entry = result("pipeline", {"minutes": length, "normalizer": "native"}, timing, "audio_seconds", duration)
+        entry["stages"] = {name: stage["wall_time"] for name, stage in fastest["stages"].items()}
+        entry["clip_latency"] = fastest["clip_latency"]
+        yield entry
+
+
+def bench_similarity(work, clips, repeat):
+    """
+    Similarity scoring of validation.py between two folders of synthetic clips, with the feature extractor and
+    the x-vector model replaced by stubs.
+    """
+    import torch
+    import validation
+    folders = [os.path.join(work, "similarity_{0}".format(k)) for k in (1, 2)]
+    n_files = max(2, int(np.sqrt(clips)))  # mode all compares every pair
+    for k, folder in enumerate(folders):
+        write_synthetic_clips(folder, n_files, sample_rate=16000, seed=1000 * (k + 1))
+    embedder = validation.SpeakerEmbedder(StubFeatureExtractor(), stub_xvector(), torch.device("cpu"))
+    yield result("similarity", {"mode": "all", "files": n_files},
+                 measure(lambda: validation.get_similarities(folders[0], folders[1], embedder), repeat),
+                 "pairs", n_files * n_files)
+    yield result("similarity", {"mode": "random", "files": n_files, "comparisons": clips},
+                 measure(lambda: validation.get_similarities_random(folders[0], folders[1], embedder, clips), repeat),
+                 "pairs", clips)
+    # Every clip already in the embedding cache (the first run fills it)
+    from embedding_cache import EmbeddingCache
+    cache = EmbeddingCache("stub", os.path.join(work, "embedding_cache"))
+    yield result("similarity", {"mode": "all", "files": n_files, "cache": "warm"},
+                 measure(lambda: validation.get_similarities(folders[0], folders[1], embedder, cache), repeat),
+                 "pairs", n_files * n_files)
+    cache.close()
+
+
+BENCHMARKS = {
+    "check_segments": lambda work, config: bench_check_segments(config["words"], config["repeat"]),
+    "cleaners": lambda work, config: bench_cleaners(config["words"], config["repeat"]),
+    "get_audio_length": lambda work, config: bench_get_audio_length(work, config["clips"], config["repeat"]),
+    "normalize_audio": lambda work, config: bench_normalize_audio(work, config["clips"], config["repeat"]),
+    "cut": lambda work, config: bench_cut(work, config["minutes"], config["repeat"]),
+    "pipeline": lambda work, config: bench_pipeline(work, config["minutes"], config["repeat"]),
+    "similarity": lambda work, config: bench_similarity(work, config["clips"], config["repeat"]),
+}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.decode().strip() or None
+    except OSError:
+        commit = None
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "cpu_count": os.cpu_count()}
+
+
+def run_benchmarks(names, config, work):
+    """
+    Runs the selected benchmarks and returns their results. A benchmark that cannot run here (missing ffmpeg,
+    torch or the validation dependencies) is reported as skipped with the reason instead of failing the suite.
+    """
+    results = []
+    for name in names:
+        print("Running {0}...".format(name))
+        try:
+            for entry in BENCHMARKS[name](work, config):
+                if "skipped" in entry:
+                    print("  {0} {1}: skipped ({2})".format(entry["name"], entry["params"], entry["skipped"]))
+                else:
+                    print("  {0} {1}: {2:.4f}s".format(entry["name"], entry["params"], entry["min"]))
+                results.append(entry)
+        except (ImportError, OSError, ValueError) as e:
+            print("  skipped: {0}".format(e))
+            results.append(skipped(name, dict(), e))
+    return results
+
+
+def compare(old_path, new_path):
+    """
+    Prints the speedup of every benchmark of new_path over the same benchmark (name and params) of old_path.
+    """
+    with open(old_path, "r", encoding="utf8") as f:
+        old = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"] if "min" in r}
+    with open(new_path, "r", encoding="utf8") as f:
+        new = [r for r in json.load(f)["results"] if "min" in r]
+    for r in new:
+        previous = old.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if previous is not None:
+            print("{0:<34}{1:<60}{2:>10.4f}s{3:>10.4f}s{4:>8.2f}x".format(
+                r["name"], json.dumps(r["params"]), previous["min"], r["min"], previous["min"] / r["min"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the dataset pipeline on synthetic audio and transcripts.'
+                                                 + ' Runs offline on CPU, the models are replaced by stubs.')
+    parser.add_argument('-b', '--benchmarks', type=str, nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS),
+                        help='Benchmarks to run. Default is all of them.')
+    parser.add_argument('-p', '--preset', type=str, default="quick", choices=list(PRESETS),
+                        help='Sizes to run. quick takes a few minutes, full runs hours of audio and 100k words.')
+    parser.add_argument('--words', type=int, nargs="+", default=None, help='Transcript sizes in words (overrides the preset)')
+    parser.add_argument('--minutes', type=float, nargs="+", default=None, help='Audio lengths in minutes (overrides the preset)')
+    parser.add_argument('--clips', type=int, default=None, help='Number of short clips (overrides the preset)')
+    parser.add_argument('-r', '--repeat', type=int, default=None, help='Repetitions of every measure (overrides the preset)')
+    parser.add_argument('-o', '--output', type=str, default="benchmark_results.json", help='JSON file with the results')
+    parser.add_argument('--work_dir', type=str, default=None,
+                        help='Folder for the synthetic data. Default is a temporary folder, removed at the end.')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Results JSON of a previous run (e.g. another commit) to compare the new results with')
+    args = parser.parse_args()
+
+    config = dict(PRESETS[args.preset])
+    for key in ("words", "minutes", "clips", "repeat"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    output = os.path.abspath(args.output)
+    work = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="benchmark-")
+    os.makedirs(work, exist_ok=True)
+    try:
+        results = run_benchmarks(args.benchmarks, config, work)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work, ignore_errors=True)
+    with open(output, "w", encoding="utf8") as f:
+        json.dump({"environment": environment(), "config": config, "results": results}, f, indent=4)
+    print("Results written to {0}".format(output))
+    if args.compare:
+        compare(args.compare, output)
@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from audio_io import decode_audio, open_wav
+from audio_join import JoinedAudio
+from audio_norm import resample, to_mono
+from transcription import WHISPER_SAMPLE_RATE
+from transcription_cache import audio_hash
+from vad import frame_energy
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tfg", "chunks")
+FRAME_LENGTH = 0.05  # seconds
+
+
+def open_source(audio):
+    """
+    Returns (samples, sample_rate) for a path, JoinedAudio stream or (samples, sample_rate) tuple without
+    decoding it whole when possible: WAV files are memory-mapped and JoinedAudio streams sliced lazily.
+    """
+    if isinstance(audio, JoinedAudio):
+        return audio, audio.sample_rate
+    if isinstance(audio, tuple):
+        return audio
+    try:
+        return open_wav(audio)
+    except ValueError:
+        return decode_audio(audio, WHISPER_SAMPLE_RATE, 1)
+
+
+def find_split_points(energy, duration, chunk_length, search=30.0, frame_length=FRAME_LENGTH):
+    """
+    Returns the boundaries (in seconds, including 0 and duration) of windows of about chunk_length seconds.
+    Every boundary is moved to the lowest energy frame within search seconds of its nominal position.
+    """
+    boundaries = [0.0]
+    while duration - boundaries[-1] > chunk_length + search:
+        nominal = boundaries[-1] + chunk_length
+        first = int((nominal - search) / frame_length)
+        last = min(int((nominal + search) / frame_length), len(energy))
+        if last <= first:
+            boundaries.append(nominal)
+        else:
+            boundaries.append((first + int(np.argmin(energy[first:last])) + 0.5) * frame_length)
+    boundaries.append(duration)
+    return boundaries
+
+
+def shift_segment(segment, offset):
+    segment = dict(segment)
+    for key in ("start", "end"):
+        if key in segment:
+            segment[key] = segment[key] + offset
+    if "words" in segment:
+        words = []
+        for word in segment["words"]:
+            word = dict(word)
+            for key in ("start", "end"):
+                if key in word:
+                    word[key] = word[key] + offset
+            words.append(word)
+        segment["words"] = words
+    return segment
+
+
+def word_midpoint(word):
+    return (word["start"] + word["end"]) / 2
+
+
+def keep_in_range(segments, start, end):
+    """
+    Keeps the part of every segment (with global timestamps) that belongs to the range [start, end) of a window:
+    the words whose midpoint is in the range. A segment that crosses a boundary is split there and its start,
+    end and text are rebuilt from the kept words, so the other window supplies the rest of the utterance.
+    Words without timestamps go with the previous word; segments without words are kept if they start in range.
+    """
+    kept = []
+    for segment in segments:
+        words = segment.get("words")
+        if not words:
+            if start <= segment["start"] < end:
+                kept.append(segment)
+            continue
+        position, inside = segment["start"], []
+        for word in words:
+            if "start" in word and "end" in word:
+                position = word_midpoint(word)
+            inside.append(start <= position < end)
+        if all(inside):
+            kept.append(segment)
+        elif any(inside):
+            words = [word for word, keep in zip(words, inside) if keep]
+            timed = [word for word in words if "start" in word and "end" in word]
+            segment = dict(segment, words=words, text=" ".join(word["word"].strip() for word in words))
+            if timed:
+                segment["start"], segment["end"] = timed[0]["start"], timed[-1]["end"]
+            kept.append(segment)
+    return kept
+
+
+class ChunkedBackend:
+    """
+    Wraps a transcription backend to transcribe long recordings in windows of about chunk_length seconds.
+    Windows are split at low energy points and extended by overlap seconds on each side. Timestamps are
+    shifted back to the global timeline and every word is kept only by the window whose own range (without the
+    overlap) contains its midpoint, which removes the duplicates of the overlap and stitches the utterances that
+    cross a boundary (see keep_in_range).
+    Every finished window is checkpointed, so an interrupted run resumes at the first missing window.
+    """
+
+    def __init__(self, backend, chunk_length=600.0, overlap=5.0, checkpoint_dir=DEFAULT_CHECKPOINT_DIR):
+        self.backend = backend
+        self.chunk_length = chunk_length
+        self.overlap = overlap
+        self.checkpoint_dir = checkpoint_dir
+
+    def __getattr__(self, item):
+        # Expose model, align_model, language... of the wrapped backend (used by CachedBackend)
+        return getattr(self.backend, item)
+
+    def window_audio(self, samples, sample_rate, start, end):
+        x = to_mono(samples[int(start * sample_rate):int(end * sample_rate)])
+        return resample(x, sample_rate, WHISPER_SAMPLE_RATE), WHISPER_SAMPLE_RATE
+
+    def transcribe(self, audio, content_hash=None) -> dict:
+        samples, sample_rate = open_source(audio)
+        duration = len(samples) / sample_rate
+        boundaries = find_split_points(frame_energy(samples, sample_rate, FRAME_LENGTH), duration,
+                                       self.chunk_length)
+        n_windows = len(boundaries) - 1
+
+        key = content_hash or audio_hash((samples, sample_rate))
+        checkpoint = os.path.join(self.checkpoint_dir, key)
+        os.makedirs(checkpoint, exist_ok=True)
+        plan = {"stitching": "words", "boundaries": boundaries, "overlap": self.overlap, "model": self.backend.model,
+                "align_model": self.backend.align_model, "language": self.backend.language}
+        plan_path = os.path.join(checkpoint, "plan.json")
+        if os.path.exists(plan_path):
+            with open(plan_path, "r", encoding="utf8") as f:
+                if json.load(f) != plan:
+                    shutil.rmtree(checkpoint)
+                    os.makedirs(checkpoint)
+        with open(plan_path, "w", encoding="utf8") as f:
+            json.dump(plan, f)
+
+        segments = []
+        for k in range(n_windows):
+            window_path = os.path.join(checkpoint, "window_{0:05d}.json".format(k))
+            if os.path.exists(window_path):
+                with open(window_path, "r", encoding="utf8") as f:
+                    kept = json.load(f)
+                print("Window {0}/{1} loaded from checkpoint".format(k + 1, n_windows))
+            else:
+                start = max(0.0, boundaries[k] - self.overlap)
+                end = min(duration, boundaries[k + 1] + self.overlap)
+                print("Transcribing window {0}/{1} ({2:.0f}s - {3:.0f}s)".format(k + 1, n_windows, start, end))
+                results = self.backend.transcribe(self.window_audio(samples, sample_rate, start, end))
+                kept = keep_in_range([shift_segment(segment, start) for segment in results["segments"]],
+                                     boundaries[k], boundaries[k + 1] if k < n_windows - 1 else float("inf"))
+                tmp_path = window_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf8") as f:
+                    json.dump(kept, f, ensure_ascii=False)
+                os.replace(tmp_path, window_path)
+            segments.extend(kept)
+        shutil.rmtree(checkpoint, ignore_errors=True)
+        return {"segments": segments}
@@ -0,0 +1,192 @@
+import argparse
+import csv
+import json
+import os
+import random
+from collections import namedtuple
+
+import numpy as np
+
+from audio_io import write_wav
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_PATH_PREFIX = "/content/tacotron2/wavs/"
+DEFAULT_SHARD_SIZE = 256 * 1024 ** 2  # bytes
+SHARDS_FOLDER = "shards"
+DATASET_INFO_FILE = "dataset_info.json"
+
+# Output of a clip worker. samples is the normalized int16 audio in shards mode, None otherwise.
+ClipResult = namedtuple("ClipResult", ["index", "text", "cleaned_text", "duration", "samples"])
+
+MANIFEST_COLUMNS = ["index", "path", "text", "cleaned_text", "duration", "source", "source_start", "source_end",
+                    "speaker", "shard", "offset", "n_samples"]
+
+
+class DatasetWriter:
+    """
+    Single writer of the cutting stage. Receives the clips in index order and writes
+    - output_format="wavs": metadata.txt, the clips are written to wavs/ by the workers
+    - output_format="shards": the clips packed as raw 16 bit PCM into shards/shard-NNNNN.pcm files of about
+      shard_size bytes, no wavs/ folder
+    and, when closed, a columnar manifest (manifest.parquet if pyarrow is installed, manifest.csv otherwise)
+    plus train.txt / val.txt split files sorted into length buckets.
+    Paths in metadata.txt and the split files are path_prefix + index + ".wav".
+    With append=True the clips are added to the dataset already in out_folder: metadata.txt is appended to, new
+    shards are started after the existing ones, and the manifest, split files and dataset_info.json are rewritten
+    with the clips of the existing manifest plus the new ones (a new clip replaces an old one with its index).
+    """
+
+    def __init__(self, out_folder, output_format="wavs", path_prefix=DEFAULT_PATH_PREFIX, speaker=None,
+                 sample_rate=22050, shard_size=DEFAULT_SHARD_SIZE, append=False):
+        if output_format not in ("wavs", "shards"):
+            raise ValueError("Unknown output format {0}. Options: wavs, shards".format(output_format))
+        self.out_folder = out_folder
+        self.output_format = output_format
+        self.path_prefix = path_prefix
+        self.speaker = speaker or os.path.basename(os.path.normpath(out_folder))
+        self.sample_rate = sample_rate
+        self.shard_size = shard_size
+        self.rows = []
+        self.shard = None
+        self.shard_index = -1
+        self.append = append
+        self.metadata = None
+        if output_format == "wavs":
+            self.metadata = open(os.path.join(out_folder, "metadata.txt"), "a" if append else "w", encoding="utf8")
+        else:
+            os.makedirs(os.path.join(out_folder, SHARDS_FOLDER), exist_ok=True)
+            if append:
+                self.shard_index = len([name for name in os.listdir(os.path.join(out_folder, SHARDS_FOLDER))
+                                        if name.startswith("shard-") and name.endswith(".pcm")]) - 1
+        self.lines = []
+
+    def clip_path(self, index):
+        return self.path_prefix + str(index) + ".wav"
+
+    def _next_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        self.shard_index += 1
+        self.shard = open(os.path.join(self.out_folder, SHARDS_FOLDER, "shard-{0:05d}.pcm".format(self.shard_index)), "wb")
+
+    def add(self, clip: ClipResult, source=None, source_start=None, source_end=None):
+        shard, offset, n_samples = None, None, None
+        if self.output_format == "shards":
+            data = np.ascontiguousarray(clip.samples, dtype="<i2").tobytes()
+            if self.shard is None or (self.shard.tell() > 0 and self.shard.tell() + len(data) > self.shard_size):
+                self._next_shard()
+            shard, offset, n_samples = self.shard_index, self.shard.tell(), len(clip.samples)
+            self.shard.write(data)
+        else:
+            self.lines.append("{0}|{1}\n".format(self.clip_path(clip.index), clip.cleaned_text))
+            if len(self.lines) >= 256:
+                self.flush()
+        self.rows.append((clip.index, self.clip_path(clip.index), clip.text.strip(), clip.cleaned_text, clip.duration,
+                          source, source_start, source_end, self.speaker, shard, offset, n_samples))
+
+    def flush(self):
+        if self.metadata is not None and self.lines:
+            self.metadata.writelines(self.lines)
+            self.metadata.flush()
+        self.lines = []
+
+    def close(self, val_fraction=0.05, bucket_width=1.0, seed=1234):
+        self.flush()
+        if self.metadata is not None:
+            self.metadata.close()
+        if self.shard is not None:
+            self.shard.close()
+        rows = self.rows
+        if self.append and (os.path.exists(os.path.join(self.out_folder, "manifest.parquet"))
+                            or os.path.exists(os.path.join(self.out_folder, "manifest.csv"))):
+            new = {row[0] for row in rows}
+            rows = [tuple(row[name] for name in MANIFEST_COLUMNS) for row in read_manifest(self.out_folder)
+                    if row["index"] not in new] + rows
+        write_manifest(self.out_folder, rows)
+        write_splits(self.out_folder, rows, val_fraction, bucket_width, seed)
+        with open(os.path.join(self.out_folder, DATASET_INFO_FILE), "w", encoding="utf8") as f:
+            json.dump({"output_format": self.output_format, "sample_rate": self.sample_rate, "sample_width": 2,
+                       "channels": 1, "path_prefix": self.path_prefix, "speaker": self.speaker,
+                       "clips": len(rows), "shards": self.shard_index + 1}, f, indent=4)
+
+
+def write_manifest(out_folder, rows):
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(MANIFEST_COLUMNS)}
+    if pyarrow is not None:
+        pyarrow.parquet.write_table(pyarrow.table(columns), os.path.join(out_folder, "manifest.parquet"))
+        return
+    with open(os.path.join(out_folder, "manifest.csv"), "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(MANIFEST_COLUMNS)
+        writer.writerows(rows)
+
+
+def write_splits(out_folder, rows, val_fraction=0.05, bucket_width=1.0, seed=1234):
+    """
+    Writes train.txt and val.txt in metadata.txt format. Clips are assigned to the validation set at random
+    (reproducible with seed) and every file is sorted into buckets of bucket_width seconds, shuffled inside
+    each bucket, so batches read in order contain clips of similar length.
+    """
+    rng = random.Random(seed)
+    rows = list(rows)
+    rng.shuffle(rows)
+    n_val = int(round(len(rows) * val_fraction))
+    for name, split in (("val.txt", rows[:n_val]), ("train.txt", rows[n_val:])):
+        split = sorted(split, key=lambda row: int(row[4] // bucket_width))
+        with open(os.path.join(out_folder, name), "w", encoding="utf8") as f:
+            f.writelines("{0}|{1}\n".format(row[1], row[3]) for row in split)
+
+
+def read_manifest(folder):
+    """
+    Returns the manifest of a dataset folder as a list of dicts.
+    """
+    if os.path.exists(os.path.join(folder, "manifest.parquet")):
+        if pyarrow is None:
+            raise ImportError("pyarrow is needed to read manifest.parquet")
+        return pyarrow.parquet.read_table(os.path.join(folder, "manifest.parquet")).to_pylist()
+    with open(os.path.join(folder, "manifest.csv"), "r", encoding="utf8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key in ("index", "shard", "offset", "n_samples"):
+            row[key] = int(row[key]) if row[key] not in ("", None) else None
+        for key in ("duration", "source_start", "source_end"):
+            row[key] = float(row[key]) if row[key] not in ("", None) else None
+    return rows
+
+
+def read_clip(folder, row):
+    """
+    Returns the int16 samples of a clip of a sharded dataset, reading only its region of the shard.
+    """
+    path = os.path.join(folder, SHARDS_FOLDER, "shard-{0:05d}.pcm".format(row["shard"]))
+    return np.memmap(path, dtype="<i2", mode="r", offset=row["offset"], shape=(row["n_samples"],))
+
+
+def unpack_shards(folder, wavs_folder):
+    """
+    Writes every clip of a sharded dataset as wavs_folder/index.wav, for tools that need one file per clip.
+    """
+    with open(os.path.join(folder, DATASET_INFO_FILE), "r", encoding="utf8") as f:
+        sample_rate = json.load(f)["sample_rate"]
+    os.makedirs(wavs_folder, exist_ok=True)
+    rows = read_manifest(folder)
+    for row in rows:
+        write_wav(os.path.join(wavs_folder, str(row["index"]) + ".wav"), read_clip(folder, row), sample_rate)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tools for datasets written with --output_format shards')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    unpack = subparsers.add_parser("unpack", help="Write every clip of the shards as a wav file")
+    unpack.add_argument('-f', '--folder', type=str, required=True, help='Dataset folder')
+    unpack.add_argument('-o', '--output', type=str, required=True, help='Folder to write the wav files to')
+    args = parser.parse_args()
+    if args.command == "unpack":
+        print("Unpacked {0} clips".format(unpack_shards(args.folder, args.output)))
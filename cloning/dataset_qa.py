@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from audio_io import open_wav
+from audio_norm import to_mono
+from dataset_export import DATASET_INFO_FILE, read_clip, read_manifest
+
+FRAME_LENGTH = 0.01  # seconds
+BATCH_SAMPLES = 1 << 24  # samples loaded and analyzed at once (64 MB as float32)
+CLIP_LEVEL = 0.999  # absolute sample value counted as clipped
+TOP_DB = 40.0  # frames more than TOP_DB below the loudest frame of the clip are silence
+HISTOGRAM_BIN = 1.0  # seconds
+
+DEFAULT_THRESHOLDS = {
+    "min_duration": 1.0,  # seconds
+    "max_duration": 10.0,  # seconds
+    "max_clipping": 0.001,  # fraction of clipped samples
+    "min_rms_db": -40.0,  # dBFS
+    "max_silence": 1.0,  # seconds of leading or trailing silence
+    "min_snr_db": 15.0,
+    "chars_per_second_mads": 3.5,  # robust z-score of the speaking rate
+}
+STATS = ["duration", "rms_db", "peak_db", "clipping_ratio", "leading_silence", "trailing_silence", "snr_db",
+         "chars_per_second"]
+
+
+def read_metadata(path):
+    """
+    Returns {clip file name: (line, text)} for a metadata.txt in path|text format.
+    """
+    metadata = dict()
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            if "|" in line:
+                clip_path, text = line.rstrip("\n").split("|", 1)
+                metadata[os.path.basename(clip_path)] = (line if line.endswith("\n") else line + "\n", text)
+    return metadata
+
+
+def dataset_clips(folder):
+    """
+    Returns [(clip file name, loader)] for the clips of a dataset folder written as wavs (wavs/*.wav) or as shards.
+    loader() returns (samples, sample_rate).
+    """
+    info_path = os.path.join(folder, DATASET_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf8") as f:
+            info = json.load(f)
+        if info["output_format"] == "shards":
+            return [(os.path.basename(row["path"]), lambda row=row: (read_clip(folder, row), info["sample_rate"]))
+                    for row in read_manifest(folder)]
+    wavs = os.path.join(folder, "wavs") if os.path.isdir(os.path.join(folder, "wavs")) else folder
+    return [(filename, lambda path=os.path.join(wavs, filename): open_wav(path))
+            for filename in sorted(os.listdir(wavs)) if filename.lower().endswith(".wav")]
+
+
+def batch_stats(arrays, sample_rates, frame_length=FRAME_LENGTH, top_db=TOP_DB):
+    """
+    Signal statistics of a batch of mono float clips, computed on their concatenation with reduceat instead of
+    clip by clip. Returns a dict of arrays with one value per clip (NaN for empty clips).
+    """
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    rates = np.asarray(sample_rates, dtype=np.float64)
+    stats = {name: np.full(len(arrays), np.nan) for name in STATS if name != "chars_per_second"}
+    stats["duration"] = lengths / rates
+    valid = np.flatnonzero(lengths > 0)  # reduceat needs non-empty segments
+    if len(valid) == 0:
+        return stats
+    lengths, rates = lengths[valid], rates[valid]
+    flat = np.concatenate([arrays[i] for i in valid])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    squares = np.square(flat, dtype=np.float64)
+    magnitude = np.abs(flat)
+
+    stats["rms_db"][valid] = 10 * np.log10(np.add.reduceat(squares, offsets) / lengths + 1e-10)
+    stats["peak_db"][valid] = 20 * np.log10(np.maximum.reduceat(magnitude, offsets) + 1e-10)
+    stats["clipping_ratio"][valid] = np.add.reduceat((magnitude >= CLIP_LEVEL).astype(np.int64), offsets) / lengths
+
+    # Frames of frame_length seconds inside every clip (the last one can be shorter)
+    frame = np.maximum((frame_length * rates).astype(np.int64), 1)
+    n_frames = -(-lengths // frame)
+    frame_clip = np.repeat(np.arange(len(valid)), n_frames)
+    clip_frames = np.concatenate([[0], np.cumsum(n_frames)[:-1]])  # index of the first frame of every clip
+    local = np.arange(len(frame_clip)) - clip_frames[frame_clip]
+    starts = offsets[frame_clip] + local * frame[frame_clip]
+    sizes = np.minimum(frame[frame_clip], offsets[frame_clip] + lengths[frame_clip] - starts)
+    energy_db = 10 * np.log10(np.add.reduceat(squares, starts) / sizes + 1e-10)
+
+    voiced = energy_db > np.maximum.reduceat(energy_db, clip_frames)[frame_clip] - top_db
+    first = np.minimum.reduceat(np.where(voiced, local, n_frames[frame_clip]), clip_frames)
+    last = np.maximum.reduceat(np.where(voiced, local, -1), clip_frames)
+    # The loudest frame is always voiced, so every clip has a first and a last voiced frame
+    stats["leading_silence"][valid] = first * frame / rates
+    stats["trailing_silence"][valid] = (n_frames - 1 - last) * frame / rates
+
+    # SNR estimate: 90th minus 10th percentile of the frame energies, sorting the frames of all clips at once
+    order = np.lexsort((energy_db, frame_clip))
+    sorted_db = energy_db[order]
+    stats["snr_db"][valid] = (sorted_db[clip_frames + ((n_frames - 1) * 9) // 10]
+                              - sorted_db[clip_frames + (n_frames - 1) // 10])
+    return stats
+
+
+def clip_stats(clips, batch_samples=BATCH_SAMPLES):
+    """
+    Loads every clip once and returns (names, stats), stats being a dict of arrays (see batch_stats).
+    Clips are analyzed in batches of about batch_samples samples to bound memory.
+    """
+    names = [name for name, _ in clips]
+    parts = []
+    arrays, rates, size = [], [], 0
+    for k, (_, loader) in enumerate(clips):
+        samples, sample_rate = loader()
+        arrays.append(to_mono(samples))
+        rates.append(sample_rate)
+        size += len(samples)
+        if size >= batch_samples or k == len(clips) - 1:
+            parts.append(batch_stats(arrays, rates))
+            arrays, rates, size = [], [], 0
+    if not parts:
+        return names, {name: np.zeros(0) for name in STATS if name != "chars_per_second"}
+    return names, {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def describe(values):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return {"count": 0}
+    p5, p50, p95 = np.percentile(values, [5, 50, 95])
+    return {"count": len(values), "mean": float(values.mean()), "std": float(values.std()),
+            "min": float(values.min()), "p5": float(p5), "median": float(p50), "p95": float(p95),
+            "max": float(values.max())}
+
+
+def find_outliers(stats, thresholds):
+    """
+    Returns the list of reasons to discard every clip (empty when the clip is fine).
+    """
+    reasons = [[] for _ in range(len(stats["duration"]))]
+
+    def flag(mask, reason):
+        for i in np.flatnonzero(mask):
+            reasons[i].append(reason)
+
+    with np.errstate(invalid="ignore"):
+        flag(stats["duration"] < thresholds["min_duration"], "too short")
+        flag(stats["duration"] > thresholds["max_duration"], "too long")
+        flag(stats["clipping_ratio"] > thresholds["max_clipping"], "clipping")
+        flag(stats["rms_db"] < thresholds["min_rms_db"], "too quiet")
+        flag(np.maximum(stats["leading_silence"], stats["trailing_silence"]) > thresholds["max_silence"],
+             "long silence")
+        flag(stats["snr_db"] < thresholds["min_snr_db"], "noisy")
+        cps = stats["chars_per_second"]
+        known = np.isfinite(cps)
+        if known.any():
+            median = np.median(cps[known])
+            mad = 1.4826 * np.median(np.abs(cps[known] - median))
+            if mad > 0:
+                flag(np.abs(cps - median) > thresholds["chars_per_second_mads"] * mad, "speaking rate")
+    return reasons
+
+
+def analyze(folder, metadata_path=None, thresholds=None):
+    """
+    Runs the QA of a dataset folder. Returns the report dict: summary statistics, duration histogram and the
+    outliers with their reasons, plus the metadata lines of the clips that passed (under "kept_lines").
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or dict()))
+    metadata_path = metadata_path or os.path.join(folder, "metadata.txt")
+    metadata = read_metadata(metadata_path) if os.path.exists(metadata_path) else dict()
+    clips = dataset_clips(folder)
+    names, stats = clip_stats(clips)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["chars_per_second"] = np.array([len(metadata[name][1]) if name in metadata else np.nan
+                                              for name in names]) / stats["duration"]
+    reasons = find_outliers(stats, thresholds)
+    for i, name in enumerate(names):
+        if metadata and name not in metadata:
+            reasons[i].append("no text")
+
+    durations = stats["duration"][np.isfinite(stats["duration"])]
+    edges = np.arange(0, np.ceil(durations.max() / HISTOGRAM_BIN) + 1) * HISTOGRAM_BIN if len(durations) else [0, 1]
+    counts, edges = np.histogram(durations, bins=edges)
+    outliers = [dict(name=name, reasons=reasons[i],
+                     **{stat: float(stats[stat][i]) if np.isfinite(stats[stat][i]) else None for stat in STATS})
+                for i, name in enumerate(names) if reasons[i]]
+    present = set(names)
+    return {
+        "folder": os.path.abspath(folder),
+        "clips": len(names),
+        "total_duration": float(durations.sum()),
+        "thresholds": thresholds,
+        "summary": {stat: describe(stats[stat]) for stat in STATS},
+        "duration_histogram": {"edges": [float(e) for e in edges], "counts": [int(c) for c in counts]},
+        "outliers": outliers,
+        "missing_audio": sorted(name for name in metadata if name not in present),
+        "kept_lines": [metadata[name][0] for i, name in enumerate(names) if not reasons[i] and name in metadata],
+    }
+
+
+def write_report(report, path, filtered_metadata=None):
+    if filtered_metadata:
+        with open(filtered_metadata, "w", encoding="utf8") as f:
+            f.writelines(report["kept_lines"])
+    with open(path, "w", encoding="utf8") as f:
+        json.dump({key: value for key, value in report.items() if key != "kept_lines"}, f, indent=4,
+                  ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quality report of a dataset: durations, loudness, clipping, silence,'
+                                                 + ' SNR and speaking rate, with the clips that look wrong')
+    parser.add_argument('-f', '--folder', type=str, required=True,
+                        help='Dataset folder (with wavs/ or shards/ and metadata.txt) or folder of wav files')
+    parser.add_argument('-m', '--metadata', type=str, default=None, help='metadata.txt, default is the one in the folder')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Report file, default is folder/qa_report.json')
+    parser.add_argument('--filtered_metadata', type=str, default=None,
+                        help='Write the metadata lines of the clips without problems to this file')
+    for name, value in DEFAULT_THRESHOLDS.items():
+        parser.add_argument('--' + name, type=float, default=value, help='Default is {0}'.format(value))
+    args = parser.parse_args()
+
+    report = analyze(args.folder, args.metadata, {name: getattr(args, name) for name in DEFAULT_THRESHOLDS})
+    output = args.output or os.path.join(args.folder, "qa_report.json")
+    write_report(report, output, args.filtered_metadata)
+    summary = report["summary"]["duration"]
+    print("{0} clips, {1:.1f} minutes (mean {2:.2f}s, std {3:.2f}s)".format(
+        report["clips"], report["total_duration"] / 60, summary.get("mean", 0), summary.get("std", 0)))
+    print("{0} outliers, {1} metadata lines without audio. Report written to {2}".format(
+        len(report["outliers"]), len(report["missing_audio"]), output))
+    if args.filtered_metadata:
+        print("{0} clips kept in {1}".format(len(report["kept_lines"]), args.filtered_metadata))
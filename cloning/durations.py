@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import get_audio_length
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tfg", "durations")
+
+
+class DurationIndex:
+    """
+    Durations of audio files persisted as a JSON file, keyed by absolute path. An entry is only valid while the
+    size and modification time of the file are the ones recorded with it, so edited or replaced files are probed
+    again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf8") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = dict()
+
+    @staticmethod
+    def for_folder(folder, index_dir=DEFAULT_INDEX_DIR):
+        """
+        Index of a folder, stored in index_dir under the hash of its absolute path. index_dir=None gives an
+        index that is never written to disk.
+        """
+        if index_dir is None:
+            return DurationIndex(None)
+        name = hashlib.sha1(os.path.abspath(folder).encode("utf8")).hexdigest() + ".json"
+        return DurationIndex(os.path.join(index_dir, name))
+
+    def get(self, path, stat):
+        entry = self.entries.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return None
+        return entry["duration"]
+
+    def put(self, path, stat, duration):
+        self.entries[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "duration": duration}
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def scan_durations(paths, index: DurationIndex = None, workers=None):
+    """
+    Returns the duration in seconds of every file of paths, in order. Files found in the index with the same size
+    and modification time are not opened; the others are probed in parallel (RIFF header for WAV files, ffprobe
+    otherwise) and added to the index.
+    """
+    index = index if index is not None else DurationIndex(None)
+    paths = [os.path.abspath(path) for path in paths]
+    stats = [os.stat(path) for path in paths]
+    durations = [index.get(path, stat) for path, stat in zip(paths, stats)]
+    missing = [i for i, duration in enumerate(durations) if duration is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as ex:
+            for i, duration in zip(missing, ex.map(get_audio_length, [paths[i] for i in missing])):
+                durations[i] = duration
+                index.put(paths[i], stats[i], duration)
+    return durations
+
+
+def scan_folder(folder, extensions=(".wav",), index_dir=DEFAULT_INDEX_DIR, workers=None):
+    """
+    Returns {filename: duration in seconds} for the files of the folder with one of the extensions. Durations are
+    kept in a persisted index (see DurationIndex.for_folder), so repeated scans only probe new or changed files.
+    Entries of files no longer in the folder are dropped from the index.
+    """
+    filenames = sorted(filename for filename in os.listdir(folder) if filename.lower().endswith(extensions))
+    index = DurationIndex.for_folder(folder, index_dir)
+    paths = [os.path.abspath(os.path.join(folder, filename)) for filename in filenames]
+    durations = scan_durations(paths, index, workers)
+    index.entries = {path: index.entries[path] for path in paths}
+    index.save()
+    return dict(zip(filenames, durations))
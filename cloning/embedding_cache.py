@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tfg", "embeddings")
+DEFAULT_MAX_SIZE = 256 * 1024 ** 2  # 256 MB, about 130k x-vectors of 512 floats
+INITIAL_ROWS = 1024
+
+
+def file_hash(path):
+    """
+    Content hash of a file, read byte by byte (the same clip copied or renamed gets the same hash).
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk store of the embeddings computed by one model. The embeddings are the rows of a memory-mapped .npy
+    matrix and a JSON index maps every key (the content hash of the clip) to its row and last access time. When
+    the store grows over max_size bytes the least recently used entries are removed and the matrix is compacted.
+    Lookups and inserts only touch memory and the mapped rows; the index is written by close() (or when
+    entries are evicted), so a run costs one index write however many times the store is used. Embeddings added
+    after the last close() of a process that dies are simply computed again next time.
+    The store is not meant to be written by several processes at the same time.
+    """
+
+    def __init__(self, model_id, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.model_id = model_id
+        self.directory = os.path.join(directory, hashlib.sha1(model_id.encode("utf8")).hexdigest()[:16])
+        self.max_size = max_size
+        self.matrix_path = os.path.join(self.directory, "embeddings.npy")
+        self.index_path = os.path.join(self.directory, "index.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self.entries = dict()  # key: [row, last access time]
+        self.matrix = None
+        self.dirty = False  # entries changed since the index was written
+        if os.path.exists(self.index_path) and os.path.exists(self.matrix_path):
+            try:
+                with open(self.index_path, "r", encoding="utf8") as f:
+                    self.entries = json.load(f)["entries"]
+                self.matrix = np.load(self.matrix_path, mmap_mode="r+")
+            except (OSError, ValueError, KeyError):
+                self.entries, self.matrix = dict(), None
+            if self.matrix is None or len(self.entries) > len(self.matrix):
+                self.entries, self.matrix = dict(), None
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1] if self.matrix is not None else 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def size(self):
+        """
+        Bytes taken by the stored embeddings.
+        """
+        return len(self.entries) * self.dim * 4
+
+    def get(self, keys):
+        """
+        Returns (found, embeddings): a boolean array telling which keys are in the store and the embeddings of
+        those keys, in order. The access time of the entries found is updated in memory.
+        """
+        rows = [self.entries[key][0] if key in self.entries else -1 for key in keys]
+        found = np.array([row >= 0 for row in rows], dtype=bool)
+        if not found.any():
+            return found, np.zeros((0, self.dim), dtype=np.float32)
+        now = time.time()
+        for key, hit in zip(keys, found):
+            if hit:
+                self.entries[key][1] = now
+        self.dirty = True
+        return found, np.array(self.matrix[[row for row in rows if row >= 0]])
+
+    def put(self, keys, embeddings):
+        """
+        Stores the embeddings (one row per key) and evicts the least recently used entries if the store no longer
+        fits in max_size bytes.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        if self.matrix is not None and embeddings.shape[1] != self.dim:
+            raise ValueError("Embeddings of size {0} cannot be stored with the embeddings of size {1} of {2}".format(
+                embeddings.shape[1], self.dim, self.model_id))
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.entries]
+        needed = len(self.entries) + len(new_keys)
+        if self.matrix is None or needed > len(self.matrix):
+            capacity = max(needed, INITIAL_ROWS, 2 * len(self.matrix) if self.matrix is not None else 0)
+            self.resize(capacity, embeddings.shape[1])
+        for key in new_keys:
+            self.entries[key] = [len(self.entries), 0.0]
+        now = time.time()
+        rows = []
+        for key in keys:
+            self.entries[key][1] = now
+            rows.append(self.entries[key][0])
+        self.matrix[rows] = embeddings
+        self.dirty = True
+        self.evict()
+
+    def resize(self, capacity, dim, rows=None):
+        """
+        Rewrites the matrix with room for capacity embeddings, keeping the given rows (every stored row by
+        default) in order.
+        """
+        rows = np.arange(len(self.entries)) if rows is None else np.asarray(rows, dtype=np.int64)
+        tmp_path = self.matrix_path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        for i in range(0, len(rows), 1 << 16):
+            block = rows[i:i + (1 << 16)]
+            matrix[i:i + len(block)] = self.matrix[block]
+        matrix.flush()
+        del matrix
+        self.matrix = None  # release the old mapping before replacing the file
+        os.replace(tmp_path, self.matrix_path)
+        self.matrix = np.load(self.matrix_path, mmap_mode="r+")
+
+    def close(self):
+        """
+        Writes the matrix and the index to disk if anything changed since they were last written.
+        """
+        if not self.dirty:
+            return
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.save_index()
+
+    def save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"model_id": self.model_id, "dim": self.dim, "entries": self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
+
+    def evict(self, max_size=None):
+        """
+        Removes least recently used entries until the store fits in max_size bytes. Returns the removed keys.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if self.size() <= max_size:
+            return []
+        by_access = sorted(self.entries, key=lambda key: self.entries[key][1])
+        keep = max_size // (self.dim * 4)
+        removed = by_access[:len(by_access) - keep]
+        kept = sorted(by_access[len(by_access) - keep:], key=lambda key: self.entries[key][0])
+        rows = [self.entries[key][0] for key in kept]
+        self.entries = {key: [row, self.entries[key][1]] for row, key in enumerate(kept)}
+        self.resize(max(len(kept), 1), self.dim, rows)
+        self.save_index()
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect and prune the on-disk speaker embedding cache')
+    parser.add_argument('-d', '--directory', type=str, default=DEFAULT_CACHE_DIR, help='Cache directory', required=False)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the models in the cache with their number of embeddings")
+    prune = subparsers.add_parser("prune", help="Remove least recently used embeddings until every model fits")
+    prune.add_argument('-s', '--max_size', type=float, required=True, help='Maximum size per model in MB')
+    subparsers.add_parser("clear", help="Remove every embedding")
+    args = parser.parse_args()
+
+    model_ids = []
+    for name in sorted(os.listdir(args.directory)) if os.path.isdir(args.directory) else []:
+        try:
+            with open(os.path.join(args.directory, name, "index.json"), "r", encoding="utf8") as f:
+                model_ids.append(json.load(f)["model_id"])
+        except (OSError, ValueError, KeyError):
+            continue
+    for model_id in model_ids:
+        cache = EmbeddingCache(model_id, args.directory)
+        if args.command == "list":
+            print("{0}  {1} embeddings of size {2}, {3:.1f} MB".format(model_id, len(cache), cache.dim,
+                                                                       cache.size() / 1024 ** 2))
+        elif args.command == "prune":
+            removed = cache.evict(int(args.max_size * 1024 ** 2))
+            print("{0}: removed {1} embeddings, {2:.1f} MB left".format(model_id, len(removed),
+                                                                       cache.size() / 1024 ** 2))
+        elif args.command == "clear":
+            print("{0}: removed {1} embeddings".format(model_id, len(cache.clear())))
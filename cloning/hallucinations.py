@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+HALLUCINATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hallucination_sentences.json")
+
+_punctuation_re = re.compile(r"[^\w\s]+")
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_phrase(text):
+    """
+    Case, accent-composition, punctuation and whitespace insensitive form of a sentence, used as lookup key.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _whitespace_re.sub(" ", _punctuation_re.sub(" ", text)).strip()
+
+
+def looping_ngram(tokens, max_n=4, min_repeats=4):
+    """
+    Returns the length of the shortest n-gram (n <= max_n) repeated at least min_repeats times in a row in
+    tokens, 0 if there is none. tokens[i] == tokens[i - n] for n * (min_repeats - 1) consecutive positions
+    means the last n tokens were repeated min_repeats times, so each n is checked in a single pass.
+    """
+    for n in range(1, max_n + 1):
+        run = 0
+        for i in range(n, len(tokens)):
+            run = run + 1 if tokens[i] == tokens[i - n] else 0
+            if run >= n * (min_repeats - 1):
+                return n
+    return 0
+
+
+class HallucinationFilter:
+    """
+    Finds the segments of a whisperx result that are known hallucinations (subtitle credits and similar phrases
+    of hallucination_sentences.json, compared after normalize_phrase), segments without any word, loops of the
+    same segment repeated loop_length or more times in a row (the first one is kept) and segments where an
+    n-gram of up to max_n words repeats min_repeats or more times in a row. All segments are checked in one pass.
+    """
+
+    def __init__(self, phrases=None, loop_length=3, max_n=4, min_repeats=4):
+        if phrases is None:
+            with open(HALLUCINATIONS_FILE, "r", encoding="utf8") as f:
+                phrases = json.load(f)["hallucinations"]
+        self.phrases = frozenset(normalize_phrase(phrase) for phrase in phrases)
+        self.loop_length = loop_length
+        self.max_n = max_n
+        self.min_repeats = min_repeats
+
+    def find(self, segments):
+        """
+        Returns (index, reason) for every hallucinated segment, reason being phrase, empty, loop or ngram.
+        """
+        keys = [normalize_phrase(segment["text"]) for segment in segments]
+        # Length of the run of identical consecutive segments every segment belongs to
+        runs = [0] * len(keys)
+        start = 0
+        for i in range(1, len(keys) + 1):
+            if i == len(keys) or keys[i] != keys[start]:
+                runs[start:i] = [i - start] * (i - start)
+                start = i
+        found = []
+        for i, key in enumerate(keys):
+            if key in self.phrases:
+                found.append((i, "phrase"))
+            elif not key:
+                found.append((i, "empty"))
+            elif i > 0 and key == keys[i - 1] and runs[i] >= self.loop_length:
+                found.append((i, "loop"))
+            elif looping_ngram(key.split(), self.max_n, self.min_repeats):
+                found.append((i, "ngram"))
+        return found
+
+    def filter(self, results):
+        """
+        Returns a copy of the whisperx result without the hallucinated segments.
+        """
+        found = self.find(results["segments"])
+        if found:
+            reasons = dict()
+            for _, reason in found:
+                reasons[reason] = reasons.get(reason, 0) + 1
+            print("Removed {0} hallucinated segments ({1})".format(
+                len(found), ", ".join("{0} {1}".format(n, reason) for reason, n in reasons.items())))
+        drop = {i for i, _ in found}
+        results = dict(results)
+        results["segments"] = [segment for i, segment in enumerate(results["segments"]) if i not in drop]
+        return results
+
+
+@lru_cache(maxsize=None)
+def default_filter() -> HallucinationFilter:
+    """
+    Filter with the phrases of hallucination_sentences.json, loaded once per process.
+    """
+    return HallucinationFilter()
+
+
+def remove_hallucinations(results):  # https://github.com/openai/whisper/discussions/928
+    return default_filter().filter(results)
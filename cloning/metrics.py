@@ -0,0 +1,205 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Counters measured at the start and end of every stage, in this order
+COUNTERS = ("wall_time", "cpu_time", "subprocess_cpu_time", "subprocesses", "subprocess_time", "bytes_read",
+            "bytes_written")
+PERCENTILES = (50, 90, 95, 99)
+
+_subprocess_lock = threading.Lock()
+_subprocess_totals = [0, 0.0]  # count, seconds of every subprocess launched by this process
+_subprocess_local = threading.local()  # same, per thread (for the latency of a single clip)
+
+
+def record_subprocess(seconds):
+    with _subprocess_lock:
+        _subprocess_totals[0] += 1
+        _subprocess_totals[1] += seconds
+    _subprocess_local.count = getattr(_subprocess_local, "count", 0) + 1
+    _subprocess_local.seconds = getattr(_subprocess_local, "seconds", 0.0) + seconds
+
+
+def run_subprocess(command, **kwargs):
+    """
+    subprocess.run that records the number and duration of the processes launched, for the metrics report.
+    """
+    start = time.perf_counter()
+    try:
+        return subprocess.run(command, **kwargs)
+    finally:
+        record_subprocess(time.perf_counter() - start)
+
+
+def timed_call(function, *args):
+    """
+    Runs function(*args) and returns (result, seconds, subprocesses, subprocess seconds, pid). Meant to run
+    inside the clip workers, so the latency and subprocesses of every clip reach the parent process even
+    with a process pool.
+    """
+    count = getattr(_subprocess_local, "count", 0)
+    seconds = getattr(_subprocess_local, "seconds", 0.0)
+    start = time.perf_counter()
+    result = function(*args)
+    return (result, time.perf_counter() - start, getattr(_subprocess_local, "count", 0) - count,
+            getattr(_subprocess_local, "seconds", 0.0) - seconds, os.getpid())
+
+
+def io_counters():
+    """
+    Returns (bytes read, bytes written) by this process through read/write calls (files and pipes, not
+    memory-mapped pages), or (None, None) when the platform does not expose them.
+    """
+    if psutil is not None:
+        counters = psutil.Process().io_counters()
+        return (getattr(counters, "read_chars", counters.read_bytes),
+                getattr(counters, "write_chars", counters.write_bytes))
+    try:
+        with open("/proc/self/io", "r") as f:
+            values = dict(line.split(": ") for line in f.read().splitlines())
+        return int(values["rchar"]), int(values["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def peak_rss(children=False):
+    """
+    Peak resident set size in bytes of this process (or of its largest finished child process), None if unknown.
+    """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    if psutil is not None and not children:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss)
+    return None
+
+
+def snapshot():
+    times = os.times()
+    read, written = io_counters()
+    with _subprocess_lock:
+        count, seconds = _subprocess_totals
+    return [time.perf_counter(), time.process_time(), times.children_user + times.children_system, count, seconds,
+            read, written]
+
+
+def difference(end, start):
+    return [None if a is None or b is None else a - b for a, b in zip(end, start)]
+
+
+class PipelineMetrics:
+    """
+    Collects per-stage metrics of a run: wall and CPU time, CPU time of finished child processes, number and
+    duration of the subprocesses launched, bytes read and written and the peak RSS when the stage ended, plus
+    the latency of every clip.
+    Stages are timed with the stage(name) context manager and can be entered several times (totals add up).
+    Nested stages are exclusive: the time spent in an inner stage is not counted in the outer one.
+    CPU time, I/O and subprocesses are process-wide counters, so stages running at the same time in different
+    threads (transcription and cutting in batch mode) include part of each other's work; wall time is exact.
+    """
+
+    def __init__(self):
+        self.stages = dict()
+        self.clip_latencies = []
+        self.start = time.perf_counter()
+        self.audio_duration = 0.0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        stack = self.local.__dict__.setdefault("stack", [])
+        with self.lock:
+            self._entry(name)  # stages are reported in the order they started
+        frame = [snapshot(), [0] * len(COUNTERS)]  # counters at entry, totals of nested stages
+        stack.append(frame)
+        try:
+            yield self
+        finally:
+            stack.pop()
+            delta = difference(snapshot(), frame[0])
+            own = difference(delta, frame[1])
+            if stack:
+                stack[-1][1] = [None if a is None or b is None else a + b for a, b in zip(stack[-1][1], delta)]
+            self.add(name, own)
+
+    def _entry(self, name):
+        return self.stages.setdefault(name, dict(calls=0, **{counter: 0 for counter in COUNTERS}))
+
+    def add(self, name, values, calls=1):
+        with self.lock:
+            stage = self._entry(name)
+            stage["calls"] += calls
+            for counter, value in zip(COUNTERS, values):
+                stage[counter] = None if value is None or stage[counter] is None else stage[counter] + value
+            stage["peak_rss"] = peak_rss()
+
+    def add_subprocesses(self, name, count, seconds):
+        """
+        Adds subprocesses launched outside this process (by process pool workers) to a stage.
+        """
+        with self.lock:
+            stage = self._entry(name)
+            stage["subprocesses"] += count
+            stage["subprocess_time"] += seconds
+
+    def record_clip(self, timed_result, stage="cut"):
+        """
+        Records the latency of a clip from the output of timed_call and returns the clip result.
+        """
+        result, seconds, count, subprocess_seconds, pid = timed_result
+        self.clip_latencies.append(seconds)
+        if pid != os.getpid():
+            self.add_subprocesses(stage, count, subprocess_seconds)
+        return result
+
+    def report(self) -> dict:
+        wall_time = time.perf_counter() - self.start
+        latencies = np.asarray(self.clip_latencies)
+        clips = {"count": len(latencies)}
+        if len(latencies):
+            clips.update(mean=float(latencies.mean()), max=float(latencies.max()),
+                         **{"p{0}".format(p): float(v) for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))})
+        return {"wall_time": wall_time, "audio_duration": self.audio_duration,
+                "real_time_factor": self.audio_duration / wall_time if wall_time > 0 else None,
+                "peak_rss": peak_rss(), "peak_rss_children": peak_rss(children=True),
+                "stages": self.stages, "clip_latency": clips}
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.report(), f, indent=4)
+
+    def summary(self):
+        """
+        Returns a human readable table of the stages.
+        """
+        lines = ["{0:<12}{1:>10}{2:>10}{3:>8}{4:>10}{5:>11}{6:>11}".format(
+            "stage", "wall (s)", "cpu (s)", "procs", "proc (s)", "read (MB)", "write (MB)")]
+        for name, stage in self.stages.items():
+            mb = lambda value: "-" if value is None else "{0:.1f}".format(value / 1024 ** 2)
+            lines.append("{0:<12}{1:>10.2f}{2:>10.2f}{3:>8}{4:>10.2f}{5:>11}{6:>11}".format(
+                name, stage["wall_time"], stage["cpu_time"], stage["subprocesses"], stage["subprocess_time"],
+                mb(stage["bytes_read"]), mb(stage["bytes_written"])))
+        if self.clip_latencies:
+            report = self.report()["clip_latency"]
+            lines.append("clip latency: p50 {0:.3f}s p95 {1:.3f}s max {2:.3f}s".format(
+                report["p50"], report["p95"], report["max"]))
+        return "\n".join(lines)
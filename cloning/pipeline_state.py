@@ -0,0 +1,85 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+from dataset_export import ClipResult
+
+STATE_FILE = "pipeline_manifest.json"
+
+
+def params_hash(*params):
+    """
+    Stable hash of any JSON-serializable parameters.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def find_last_run(prefix):
+    """
+    Returns the most recent output folder named prefix + timestamp (YYYYmmdd-HHMMSS), or None.
+    """
+    runs = [path for path in glob.glob(glob.escape(prefix) + "*")
+            if os.path.isdir(path) and re.fullmatch(r"\d{8}-\d{6}", path[len(prefix):])]
+    return max(runs) if runs else None
+
+
+class PipelineState:
+    """
+    Manifest of the finished stages and clips of a run, stored as pipeline_manifest.json in the output folder.
+    Every stage is recorded with the hash of its input and parameters, and every clip with the hash of the
+    parameters that produced it and the size of its wav file. Every run records its progress, so any run can be
+    completed later. With resume=True the existing manifest is loaded and the stages and clips whose inputs and
+    parameters did not change and whose files are still there are reported as done, so the rerun skips them.
+    """
+
+    def __init__(self, out_folder, resume=False):
+        self.out_folder = out_folder
+        self.path = os.path.join(out_folder, STATE_FILE)
+        self.resume = resume
+        self.stages = dict()
+        self.clips = dict()
+        if resume and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            self.stages = data.get("stages", dict())
+            self.clips = data.get("clips", dict())
+        self.unsaved = 0
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"stages": self.stages, "clips": self.clips}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+
+    def stage_done(self, name, key):
+        """
+        Returns True if the stage was completed with the same input and parameters hash.
+        """
+        return self.resume and self.stages.get(name, dict()).get("key") == key
+
+    def complete_stage(self, name, key, **info):
+        self.stages[name] = dict(key=key, **info)
+        self.save()
+
+    def clip_done(self, index, key, path=None):
+        """
+        Returns the ClipResult of a clip completed with the same parameters hash whose wav file (if path is
+        given) still has the recorded size, None otherwise.
+        """
+        clip = self.clips.get(str(index)) if self.resume else None
+        if clip is None or clip["key"] != key:
+            return None
+        if path is not None and (not os.path.exists(path) or os.path.getsize(path) != clip["size"]):
+            return None
+        return ClipResult(index, clip["text"], clip["cleaned_text"], clip["duration"], None)
+
+    def complete_clip(self, clip: ClipResult, key, path=None, save_every=64):
+        self.clips[str(clip.index)] = {"key": key, "text": clip.text, "cleaned_text": clip.cleaned_text,
+                                       "duration": clip.duration,
+                                       "size": os.path.getsize(path) if path is not None else None}
+        self.unsaved += 1
+        if self.unsaved >= save_every:
+            self.save()
@@ -0,0 +1,194 @@
+from statistics import NormalDist
+
+import numpy as np
+
+try:
+    from scipy.stats import t as student_t
+except ImportError:
+    student_t = None
+
+PERMUTATION_LIMIT = 1 << 22  # strata with at most this many pairs are drawn from a shuffled list
+
+
+def t_quantile(p, df):
+    """
+    Quantile p of the Student t distribution with df degrees of freedom (scipy if installed, otherwise the
+    Cornish-Fisher expansion around the normal quantile, within 1% of the exact value for df >= 3).
+    """
+    if not np.isfinite(df):
+        return NormalDist().inv_cdf(p)
+    if student_t is not None:
+        return float(student_t.ppf(p, df))
+    z = NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+            + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * df ** 4))
+
+
+class RunningStats:
+    """
+    Running count, mean and sum of squared deviations (Welford), updated with whole batches of values by Chan's
+    parallel formula, so the values do not need to be kept.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        m2 = np.square(values - mean).sum()
+        n = self.n + len(values)
+        delta = mean - self.mean
+        self.mean += delta * len(values) / n
+        self.m2 += m2 + delta ** 2 * self.n * len(values) / n
+        self.n = n
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+
+def length_strata(lengths, n_strata):
+    """
+    Stratum of every clip, from 0 to n_strata - 1: clips are split in n_strata groups of (almost) the same size,
+    from the shortest to the longest.
+    """
+    lengths = np.asarray(lengths)
+    if n_strata <= 1 or len(lengths) == 0:
+        return np.zeros(len(lengths), dtype=np.int64)
+    ranks = np.empty(len(lengths), dtype=np.int64)
+    ranks[np.argsort(lengths, kind="stable")] = np.arange(len(lengths))
+    return ranks * n_strata // len(lengths)
+
+
+class PairSampler:
+    """
+    Draws pairs (i, j) of clips of two folders without replacement. Pairs are grouped in strata by the strata of
+    both clips (see length_strata) and every draw goes to the stratum furthest below its share of the pairs drawn so
+    far, so all the combinations of clip lengths are represented in proportion from the first draws.
+    With distinct=True both folders are the same one (strata1 and strata2 are equal) and the pairs of a clip with
+    itself are never drawn.
+    """
+
+    def __init__(self, strata1, strata2, rng: np.random.Generator, distinct=False):
+        groups1 = [(s, np.flatnonzero(strata1 == s)) for s in np.unique(strata1)]
+        groups2 = [(s, np.flatnonzero(strata2 == s)) for s in np.unique(strata2)]
+        self.groups = [(a, b) for _, a in groups1 for _, b in groups2]
+        self.distinct = [distinct and s == t for s, _ in groups1 for t, _ in groups2]
+        self.sizes = np.array([len(a) * (len(b) - distinct) for (a, b), distinct in zip(self.groups, self.distinct)],
+                              dtype=np.int64)
+        self.weights = self.sizes / self.sizes.sum()
+        self.drawn = np.zeros(len(self.groups), dtype=np.int64)
+        self.rng = rng
+        self._seen = [set() for _ in self.groups]
+        self._permutations = [None] * len(self.groups)
+
+    def exhausted(self):
+        return bool((self.drawn == self.sizes).all())
+
+    def _draw_from(self, h):
+        a, b = self.groups[h]
+        if self.sizes[h] <= PERMUTATION_LIMIT:
+            if self._permutations[h] is None:
+                self._permutations[h] = self.rng.permutation(self.sizes[h])
+            pair = self._permutations[h][self.drawn[h]]
+        else:  # far more pairs than will ever be drawn, repeated draws are rare
+            pair = self.rng.integers(self.sizes[h])
+            while pair in self._seen[h]:
+                pair = self.rng.integers(self.sizes[h])
+            self._seen[h].add(pair)
+        self.drawn[h] += 1
+        if self.distinct[h]:  # pairs (i, j) with j != i, numbered skipping the diagonal
+            i, j = pair // (len(b) - 1), pair % (len(b) - 1)
+            return a[i], b[j + (j >= i)]
+        return a[pair // len(b)], b[pair % len(b)]
+
+    def draw(self, n):
+        """
+        Returns the arrays (i, j, stratum) of up to n new pairs (fewer when every pair was already drawn).
+        """
+        pairs = []
+        for _ in range(n):
+            available = self.drawn < self.sizes
+            if not available.any():
+                break
+            deficit = np.where(available, self.weights * (self.drawn.sum() + 1) - self.drawn, -np.inf)
+            h = int(np.argmax(deficit))
+            pairs.append((*self._draw_from(h), h))
+        i, j, h = np.array(pairs, dtype=np.int64).reshape(-1, 3).T
+        return i, j, h
+
+
+class StratifiedEstimate:
+    """
+    Estimate of the mean similarity over all the pairs from the pairs drawn by a PairSampler: the mean of every
+    stratum weighted by its share of the pairs, with the Student t confidence interval of the stratified mean
+    (Welch-Satterthwaite degrees of freedom, so it stays valid with a handful of comparisons, and the finite
+    population correction, since pairs are drawn without replacement).
+    """
+
+    def __init__(self, sampler: PairSampler):
+        self.weights = sampler.weights
+        self.sizes = sampler.sizes
+        self.stats = [RunningStats() for _ in self.weights]
+
+    @property
+    def n(self):
+        return sum(stats.n for stats in self.stats)
+
+    def update(self, similarities, strata):
+        for h in np.unique(strata):
+            self.stats[h].update(similarities[strata == h])
+
+    def mean(self):
+        sampled = np.array([stats.n > 0 for stats in self.stats])
+        means = np.array([stats.mean for stats in self.stats])
+        return float(np.sum(self.weights[sampled] * means[sampled]) / np.sum(self.weights[sampled]))
+
+    def _variance_terms(self):
+        """
+        Contribution of every stratum to the variance of the mean, None until every stratum has two comparisons
+        (or was drawn completely).
+        """
+        terms = []
+        for weight, size, stats in zip(self.weights, self.sizes, self.stats):
+            if stats.n < min(2, size):
+                return None
+            if size == 0:  # a single clip compared with itself, no pairs
+                terms.append(0.0)
+                continue
+            terms.append(weight ** 2 * stats.variance / stats.n * (1 - stats.n / size))
+        return np.array(terms)
+
+    def standard_error(self):
+        terms = self._variance_terms()
+        return float("inf") if terms is None else float(np.sqrt(terms.sum()))
+
+    def degrees_of_freedom(self):
+        terms = self._variance_terms()
+        if terms is None:
+            return 0.0
+        n = np.array([stats.n for stats in self.stats], dtype=np.float64)
+        partial = (terms > 0) & (n > 1)
+        if not partial.any():
+            return float("inf")
+        return float(terms.sum() ** 2 / np.sum(terms[partial] ** 2 / (n[partial] - 1)))
+
+    def interval(self, confidence=0.95):
+        se = self.standard_error()
+        if not np.isfinite(se):
+            return float("-inf"), float("inf")
+        half = t_quantile(0.5 + confidence / 2, self.degrees_of_freedom()) * se if se > 0 else 0.0
+        mean = self.mean()
+        return mean - half, mean + half
+
+    def report(self, confidence=0.95) -> dict:
+        low, high = self.interval(confidence)
+        return {"mean": self.mean(), "ci_low": low, "ci_high": high, "ci_width": high - low,
+                "confidence": confidence, "comparisons": self.n, "pairs": int(self.sizes.sum()),
+                "strata": len(self.stats)}
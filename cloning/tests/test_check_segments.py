@@ -0,0 +1,61 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_timeline, synthetic_transcript  # noqa: E402
+from transcribe_cut_long_audio import check_segments  # noqa: E402
+
+
+def make_segment(times):
+    """
+    Whisperx-shaped segment with one word per (start, end) pair.
+    """
+    words = [{"word": "w{0}".format(i), "start": start, "end": end} for i, (start, end) in enumerate(times)]
+    return {"start": times[0][0], "end": times[-1][1], "text": " ".join(word["word"] for word in words),
+            "words": words}
+
+
+def regular_words(start, n_words, pauses=None):
+    """
+    n_words words of 0.4 s separated by 0.1 s from start, with pauses[k] more seconds after word k.
+    """
+    pauses = pauses or dict()
+    times = []
+    t = start
+    for k in range(n_words):
+        times.append((t, t + 0.4))
+        t += 0.5 + pauses.get(k, 0.0)
+    return times
+
+
+def test_pieces_never_exceed_max_segment_duration():
+    transcript = synthetic_transcript(synthetic_timeline(n_words=3000, seed=5), missing_timestamps=0.0)
+    assert any(segment["end"] - segment["start"] > 10 for segment in transcript["segments"])
+    segments = check_segments(transcript["segments"], max_segment_duration=10)
+    assert segments
+    assert all(segment.end - segment.start <= 10 for segment in segments)
+    assert all(segment.speech_end <= segment.end for segment in segments)
+
+
+def test_long_segment_is_cut_at_the_largest_pause():
+    times = regular_words(0.0, 26, pauses={5: 0.3, 11: 0.8, 15: 0.4})
+    segments = check_segments([make_segment(times)], max_segment_duration=10)
+    assert [(segment.first_word, segment.last_word) for segment in segments] == [(0, 12), (12, 26)]
+    assert segments[0].end == times[11][1]
+    assert segments[1].start == times[12][0]
+
+
+def test_min_segment_duration_skips_pauses_that_leave_short_pieces():
+    times = regular_words(0.0, 26, pauses={2: 0.8, 13: 0.3})
+    assert check_segments([make_segment(times)], max_segment_duration=10)[0].last_word == 3
+    segments = check_segments([make_segment(times)], max_segment_duration=10, min_segment_duration=3)
+    assert [(segment.first_word, segment.last_word) for segment in segments] == [(0, 14), (14, 26)]
+    assert all(segment.end - segment.start >= 3 for segment in segments)
+
+
+def test_min_segment_duration_drops_short_clips():
+    short = make_segment([(0.0, 0.4), (0.5, 0.9)])
+    long = make_segment(regular_words(2.0, 8))
+    assert len(check_segments([short, long])) == 2
+    assert [segment.start for segment in check_segments([short, long], min_segment_duration=1)] == [2.0]
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chunked_transcription  # noqa: E402
+import transcription_cache  # noqa: E402
+from chunked_transcription import ChunkedBackend, keep_in_range  # noqa: E402
+from transcription_cache import CachedBackend, TranscriptionCache  # noqa: E402
+
+SAMPLE_RATE = 16000
+TIME_SCALE = 1000.0  # the fake audio holds its own time: sample value = seconds / TIME_SCALE
+
+
+class TimelineBackend:
+    """
+    Fake backend for continuous speech: a word every 0.5 s grouped in segments of segment_length seconds. Every
+    window is "transcribed" as the words that fit completely inside it, read from the timeline encoded in the audio.
+    """
+    model, align_model, language = "fake", "fake", "es"
+
+    def __init__(self, duration, segment_length):
+        self.words = [{"word": "w{0}".format(i), "start": i * 0.5, "end": i * 0.5 + 0.4}
+                      for i in range(int(duration / 0.5))]
+        self.segment_length = segment_length
+
+    def transcribe(self, audio):
+        samples, sample_rate = audio
+        start = float(samples[0]) * TIME_SCALE
+        end = start + len(samples) / sample_rate
+        segments = dict()
+        for word in self.words:
+            if start <= word["start"] and word["end"] <= end:
+                segments.setdefault(int(word["start"] // self.segment_length), []).append(
+                    dict(word, start=word["start"] - start, end=word["end"] - start))
+        return {"segments": [{"start": words[0]["start"], "end": words[-1]["end"],
+                              "text": " ".join(word["word"] for word in words), "words": words}
+                             for _, words in sorted(segments.items())]}
+
+
+def test_keep_in_range_splits_a_segment_at_the_boundary():
+    segment = {"start": 8.0, "end": 12.4, "text": "a b c", "words": [
+        {"word": "a", "start": 8.0, "end": 8.4}, {"word": "b", "start": 9.8, "end": 10.4},
+        {"word": "c", "start": 12.0, "end": 12.4}]}
+    before = keep_in_range([segment], 0.0, 10.0)
+    after = keep_in_range([segment], 10.0, 20.0)
+    assert [(s["text"], s["start"], s["end"]) for s in before] == [("a", 8.0, 8.4)]
+    assert [(s["text"], s["start"], s["end"]) for s in after] == [("b c", 9.8, 12.4)]
+
+
+def test_segments_crossing_window_boundaries_keep_every_word(tmp_path):
+    duration = 600.0
+    samples = (np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE / TIME_SCALE).astype(np.float32)
+    for segment_length in (8.0, 14.0):
+        backend = TimelineBackend(duration, segment_length)
+        chunked = ChunkedBackend(backend, chunk_length=120, overlap=5, checkpoint_dir=str(tmp_path))
+        segments = chunked.transcribe((samples, SAMPLE_RATE))["segments"]
+        words = [word["word"] for segment in segments for word in segment["words"]]
+        assert words == [word["word"] for word in backend.words]
+        assert " ".join(segment["text"] for segment in segments).split() == words
+
+
+def test_cached_chunked_transcription_hashes_the_audio_once(tmp_path, monkeypatch):
+    duration = 300.0
+    samples = (np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE / TIME_SCALE).astype(np.float32)
+    hashed = []
+
+    def counting_hash(audio):
+        hashed.append(audio)
+        return "0" * 64
+
+    monkeypatch.setattr(transcription_cache, "audio_hash", counting_hash)
+    monkeypatch.setattr(chunked_transcription, "audio_hash", counting_hash)
+    chunked = ChunkedBackend(TimelineBackend(duration, 8.0), chunk_length=120, overlap=5,
+                             checkpoint_dir=str(tmp_path / "checkpoints"))
+    cached = CachedBackend(chunked, TranscriptionCache(str(tmp_path / "cache")))
+    cached.transcribe((samples, SAMPLE_RATE))
+    assert len(hashed) == 1
+    cached.transcribe((samples, SAMPLE_RATE), content_hash="1" * 64)
+    assert len(hashed) == 1
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import INITIAL_ROWS, EmbeddingCache  # noqa: E402
+
+
+def test_index_is_written_once_on_close(tmp_path):
+    cache = EmbeddingCache("model", str(tmp_path))
+    embeddings = np.random.default_rng(0).normal(size=(INITIAL_ROWS + 10, 8)).astype(np.float32)
+    keys = ["clip{0}".format(i) for i in range(len(embeddings))]
+    for k in range(0, len(keys), 100):
+        cache.put(keys[k:k + 100], embeddings[k:k + 100])
+        cache.get(keys[:k + 1])
+    assert not os.path.exists(cache.index_path)
+    cache.close()
+    written = os.path.getmtime(cache.index_path)
+    cache.close()
+    assert os.path.getmtime(cache.index_path) == written
+
+    reopened = EmbeddingCache("model", str(tmp_path))
+    found, stored = reopened.get(keys + ["missing"])
+    assert found.sum() == len(keys) and not found[-1]
+    assert np.array_equal(stored, embeddings)
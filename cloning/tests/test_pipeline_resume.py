@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcribe_cut_long_audio  # noqa: E402
+from benchmark import synthetic_timeline, synthetic_transcript, write_synthetic_wav  # noqa: E402
+from pipeline_state import STATE_FILE  # noqa: E402
+from transcription import TranscriptionBackend, register_backend  # noqa: E402
+
+DURATION = 60.0
+transcripts = dict()
+calls = []
+
+
+@register_backend("resume_test")
+class CountingBackend(TranscriptionBackend):
+    def transcribe(self, audio, content_hash=None) -> dict:
+        calls.append(audio)
+        return json.loads(json.dumps(transcripts[audio]))
+
+
+def test_resume_after_a_normal_run_only_recuts_missing_clips(tmp_path, capsys):
+    path = str(tmp_path / "long.wav")
+    timeline = synthetic_timeline(duration=DURATION, seed=3)
+    write_synthetic_wav(path, timeline, DURATION, seed=3)
+    transcripts[path] = synthetic_transcript(timeline)
+    name_run = str(tmp_path / "run")
+
+    out_folder = transcribe_cut_long_audio.main(path, name_run, backend="resume_test", cache_dir=None,
+                                                normalizer="native")
+    assert len(calls) == 1
+    assert os.path.exists(os.path.join(out_folder, STATE_FILE))
+    wavs = os.path.join(out_folder, "wavs")
+    clips = sorted(os.listdir(wavs), key=lambda name: int(name[:-4]))
+    assert len(clips) > 3
+    removed = clips[:2]
+    for name in removed:
+        os.remove(os.path.join(wavs, name))
+    kept = {name: os.path.getmtime(os.path.join(wavs, name)) for name in clips[2:]}
+    capsys.readouterr()
+
+    resumed = transcribe_cut_long_audio.main(path, name_run, backend="resume_test", cache_dir=None,
+                                             normalizer="native", resume="last")
+    assert resumed == out_folder
+    assert len(calls) == 1
+    assert "Keeping {0} clips".format(len(kept)) in capsys.readouterr().out
+    assert sorted(os.listdir(wavs)) == sorted(clips)
+    assert all(os.path.getmtime(os.path.join(wavs, name)) == mtime for name, mtime in kept.items())
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import similarity_sampling  # noqa: E402
+from similarity_sampling import PairSampler, StratifiedEstimate, length_strata  # noqa: E402
+
+
+def test_distinct_sampler_draws_every_pair_of_different_clips(monkeypatch):
+    strata = length_strata(np.arange(7), 2)
+    for limit in (similarity_sampling.PERMUTATION_LIMIT, 0):  # shuffled list and rejection sampling
+        monkeypatch.setattr(similarity_sampling, "PERMUTATION_LIMIT", limit)
+        sampler = PairSampler(strata, strata, np.random.default_rng(0), distinct=True)
+        assert sampler.sizes.sum() == 7 * 6
+        i, j, _ = sampler.draw(100)
+        assert sampler.exhausted()
+        assert sorted(zip(i, j)) == [(a, b) for a in range(7) for b in range(7) if a != b]
+
+
+def test_distinct_estimate_of_all_pairs_is_the_off_diagonal_mean():
+    x = np.random.default_rng(1).normal(size=(6, 4))
+    gram = x @ x.T
+    strata = length_strata(np.arange(6), 3)
+    sampler = PairSampler(strata, strata, np.random.default_rng(2), distinct=True)
+    estimate = StratifiedEstimate(sampler)
+    i, j, h = sampler.draw(30)
+    estimate.update(gram[i, j], h)
+    assert np.isclose(estimate.mean(), gram[~np.eye(6, dtype=bool)].mean())
+    assert estimate.interval()[1] - estimate.interval()[0] == 0
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vad import refine_cuts  # noqa: E402
+
+FRAME_LENGTH = 0.01
+
+
+def silent_frames(duration, speech):
+    """
+    Silence mask of duration seconds with speech in the given (start, end) ranges.
+    """
+    times = (np.arange(int(round(duration / FRAME_LENGTH))) + 0.5) * FRAME_LENGTH
+    return ~np.any([(start <= times) & (times < end) for start, end in speech], axis=0)
+
+
+def test_start_moves_back_into_the_silence_before_a_short_first_word():
+    silent = silent_frames(10.0, [(4.85, 5.10), (5.20, 7.0)])
+    starts, ends = refine_cuts([5.00], [7.05], silent, FRAME_LENGTH, tolerance=0.2)
+    assert starts[0] <= 4.85
+    assert ends[0] >= 7.05
+
+
+def test_end_moves_forward_past_the_last_word():
+    silent = silent_frames(10.0, [(2.0, 6.90), (7.00, 7.25)])
+    starts, ends = refine_cuts([2.0], [7.10], silent, FRAME_LENGTH, tolerance=0.2)
+    assert ends[0] >= 7.25
+    assert starts[0] <= 2.0
+
+
+def test_cuts_without_silence_in_range_are_kept():
+    silent = silent_frames(10.0, [(1.0, 9.0)])
+    starts, ends = refine_cuts([4.0], [6.0], silent, FRAME_LENGTH, tolerance=0.2)
+    assert (starts[0], ends[0]) == (4.0, 6.0)
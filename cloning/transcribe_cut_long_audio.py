@@ -1,204 +1,534 @@
 import argparse
 import datetime
+import glob
+import json
 import os
 import re
-import subprocess
 import shutil
 import torch
+from collections import deque, namedtuple
 from typing import List
-from multiprocessing import Semaphore
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from threading import Thread
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from utils import multilingual_cleaners, normalize_audio, read_json, get_audio_length
+from audio_io import decode_audio, open_wav, read_wav_info, slice_seconds, write_wav
+from audio_norm import normalize_array, TARGET_SAMPLE_RATE
+from audio_join import AUDIO_EXTENSIONS, JoinedAudio, list_audio_files, normalize_files
+from transcription import available_backends, get_backend
+from transcription_cache import CachedBackend, TranscriptionCache, DEFAULT_CACHE_DIR, audio_hash
+from chunked_transcription import ChunkedBackend
+from vad import frame_energy, refine_cuts, silence_mask
+from dataset_export import ClipResult, DatasetWriter, DEFAULT_PATH_PREFIX
+from pipeline_state import PipelineState, find_last_run, params_hash
+from metrics import PipelineMetrics, run_subprocess, timed_call
+from hallucinations import remove_hallucinations
 from tqdm import tqdm
 
 
 AUDIO_FILES_LIST = "list_of_audio_files.txt"
 JOINED_AUDIO_FILE = "joined_audio.wav"
+CLIP_SOURCES_FILE = "clip_sources.txt"
+VAD_FRAME_LENGTH = 0.01
 
 
-def main(filepath, name_run="run", language="es"):
+def main(filepath, name_run="run", language="es", slicer="native", normalizer="ffmpeg", backend="whisperx",
+         cache_dir=DEFAULT_CACHE_DIR, chunk_length=0, refine_tolerance=0.0, executor="thread", workers=None,
+         output_format="wavs", path_prefix=DEFAULT_PATH_PREFIX, speaker=None, resume=None, metrics=None,
+         metrics_json=None, min_segment_duration=0):
+    """
+    Progress is recorded in the pipeline_state.PipelineState of the output folder. resume is the output folder
+    of a previous run to complete, or "last" for the most recent one with the same name: finished stages and clips
+    whose inputs and parameters did not change are skipped.
+    Per-stage timings are collected in metrics (a metrics.PipelineMetrics, created if not given) and written
+    to metrics_json when given. Clips shorter than min_segment_duration seconds are dropped (see check_segments).
+    """
     time = datetime.datetime.now()
-    original_filepath = filepath
-    # Check if filename is a folder
-    if os.path.isdir(filepath):
-        # Check if folder contains audio files
-        if len(os.listdir(filepath)) == 0:
-            raise Exception("The folder {0} is empty. Please check the path and try again.".format(filepath))
-        # Check there is at least one wav file in the folder
-        if not any([filename.endswith(".wav") for filename in os.listdir(filepath)]):
-            raise Exception(
-                "The folder {0} does not contain any wav files. Please check the path and try again.".format(filepath))
-        os.mkdir(os.path.join(filepath, "TEMP"))
-        # Normalize all the audio files in the folder
-        print("Normalizing all the audio files in the folder {0}...".format(filepath))
-        for filename in tqdm(os.listdir(filepath)):
-            if filename.endswith(".wav") or filename.endswith(".WAV") \
-                    and not filename.endswith(JOINED_AUDIO_FILE):
-                shutil.copy(os.path.join(filepath, filename), os.path.join(filepath, "TEMP", filename))
-                normalize_audio(os.path.join(filepath, "TEMP", filename))
-        print("Joining normalised audio files into a single file...")
-        with open(os.path.join(filepath, "TEMP", AUDIO_FILES_LIST), "w") as f:
-            for filename in os.listdir(filepath):
-                if filename.endswith(".wav") and not filename.endswith(JOINED_AUDIO_FILE):
-                    f.write("file '" + os.path.join(filepath, filename) + "'\n")
-        # Create the joined audio file:
-        subprocess.run(
-            ["ffmpeg", "-f", "concat", "-safe", "0", "-i", os.path.join(filepath, "TEMP", AUDIO_FILES_LIST), "-c",
-             "copy", os.path.join(filepath, JOINED_AUDIO_FILE), "-y", "-loglevel", "error", "-hide_banner"])
-        # Set filepath to the joined audio file
-        shutil.rmtree(os.path.join(filepath, "TEMP"))
-        filepath = os.path.join(filepath, JOINED_AUDIO_FILE)
-    # Check that the audio file exists
-    if not os.path.exists(filepath):
-        raise Exception("The file {0} does not exist. Please check the path and try again.".format(filepath))
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    filepath, joined_audio = prepare_input(filepath, normalizer, metrics)
+    audio = joined_audio if joined_audio is not None else filepath
 
     # Create a folder to store the audio clips and the transcription
     tmp_name = filepath.replace(".wav", "") if name_run == "run" else name_run
-    out_folder = tmp_name + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    if not os.path.exists(out_folder):
+    out_folder = resume_folder(resume, tmp_name) or tmp_name + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    state = PipelineState(out_folder, resume=bool(resume))
+    state_key = audio_hash(audio)
+    if not os.path.exists(os.path.join(out_folder, "wavs")) and output_format == "wavs":
         os.makedirs(os.path.join(out_folder, "wavs"))
+    elif not os.path.exists(out_folder):
+        os.makedirs(os.path.join(out_folder, "wavs") if output_format == "wavs" else out_folder)
 
     # Get audio file duration
-    duration = get_audio_length(filepath)
+    duration = joined_audio.duration if joined_audio is not None else get_audio_length(filepath)
     # Transcribe the audio file using OpenAI Whisper
     print(f"Transcribing audio file: {filepath} to output folder: {out_folder}...")
-    subprocess.run(
-        ["whisperx", filepath, "--model", "medium", "--align_model", "VOXPOPULI_ASR_BASE_10K_ES", "--language",
-         language,
-         "--output_format", "json", "--output_dir", out_folder])
-
-    filename = os.path.basename(filepath)
-    json_path = os.path.join(out_folder, filename.replace(".wav", ".json"))
-    results = read_json(json_path)
-    results = remove_end_hallucinations(results)
-
-    # Check segments duration and split them if they are longer than 10 seconds
-    checked_segments = check_segments(results["segments"])
+    transcriber = make_transcriber(backend, language, cache_dir, chunk_length)
+    checked_segments = transcribe_and_segment(transcriber, audio, state, state_key, metrics=metrics,
+                                              min_segment_duration=min_segment_duration)
     # Cut original audio file into clips using the custom segments
     print("Cutting audio file into clips...")
-    cut_audio_and_generate_metadata(out_folder, filepath, checked_segments)
+    writer = DatasetWriter(out_folder, output_format, path_prefix, speaker)
+    cut_audio_and_generate_metadata(out_folder, audio, checked_segments, slicer, normalizer,
+                                    refine_tolerance=refine_tolerance, executor=executor, workers=workers,
+                                    writer=writer, state=state, state_key=state_key, metrics=metrics)
+    with metrics.stage("metadata"):
+        writer.close()
     print("Done! Check the folder {0} for the audio clips and the metadata file.".format(out_folder))
     #Format the time in MM:SS format
     seconds = datetime.datetime.now().timestamp() - time.timestamp()
     timeMMSS = str(datetime.timedelta(seconds=seconds))
     print("Total processing time: {0}. Audio duration: {1}. Processing speed: {2} real time".format(timeMMSS, str(datetime.timedelta(seconds=duration)), str(duration / seconds)[:4] + "x"))
+    metrics.audio_duration += duration
+    report_metrics(metrics, metrics_json)
 
-
-    # Remove the joined audio file if it was created
-    if original_filepath != filepath:
-        os.remove(os.path.join(filepath))
-    # Remove joined_audio
-    if os.path.exists(os.path.join(out_folder, JOINED_AUDIO_FILE)):
-        os.remove(os.path.join(out_folder, JOINED_AUDIO_FILE))
     return out_folder
 
 
-def check_segments(segments, max_segment_duration=10):
+def report_metrics(metrics, metrics_json=None):
+    print(metrics.summary())
+    if metrics_json:
+        metrics.write_json(metrics_json)
+        print("Metrics written to {0}".format(metrics_json))
 
 
-    segments_to_remove = []
+def resume_folder(resume, prefix):
+    """
+    Returns the output folder to resume: resume itself, or the last run named prefix + timestamp when
+    resume is "last". None when there is nothing to resume.
+    """
+    if not resume:
+        return None
+    folder = find_last_run(prefix) if resume == "last" else resume
+    if folder is None or not os.path.isdir(folder):
+        print("No previous run found to resume, starting a new one")
+        return None
+    print("Resuming the run in {0}".format(folder))
+    return folder
+
+
+def prepare_input(filepath, normalizer="ffmpeg", metrics=None):
+    """
+    Checks the input path. Folders are decoded, normalized and joined into a JoinedAudio stream.
+    Returns the path used to name the outputs and the JoinedAudio stream (None for single files).
+    Decoding and normalizing the files of a folder is timed as the normalize stage of metrics. Joining does no
+    work of its own (JoinedAudio only records the offset of every file), so it has no stage. Single files are
+    not normalized here, only their clips while cutting (see cut_audio_and_generate_metadata).
+    """
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    # Check if filename is a folder
+    if os.path.isdir(filepath):
+        # Check if folder contains audio files
+        if len(os.listdir(filepath)) == 0:
+            raise Exception("The folder {0} is empty. Please check the path and try again.".format(filepath))
+        # Check there is at least one wav file in the folder
+        if not any([filename.endswith(".wav") for filename in os.listdir(filepath)]):
+            raise Exception(
+                "The folder {0} does not contain any wav files. Please check the path and try again.".format(filepath))
+        # Decode and normalize all the audio files in parallel and join them in memory
+        print("Normalizing and joining all the audio files in the folder {0}...".format(filepath))
+        paths = list_audio_files(filepath, exclude=(JOINED_AUDIO_FILE,))
+        with metrics.stage("normalize"):
+            chunks = normalize_files(paths, normalizer)
+        return os.path.join(filepath, JOINED_AUDIO_FILE), JoinedAudio(chunks, paths)
+    # Check that the audio file exists
+    if not os.path.exists(filepath):
+        raise Exception("The file {0} does not exist. Please check the path and try again.".format(filepath))
+    return filepath, None
+
+
+def make_transcriber(backend="whisperx", language="es", cache_dir=DEFAULT_CACHE_DIR, chunk_length=0):
+    """
+    Returns the transcription backend, wrapped in the on-disk transcription cache unless cache_dir is None.
+    With chunk_length > 0 long inputs are transcribed in checkpointed windows of about chunk_length seconds.
+    """
+    transcriber = get_backend(backend, language=language)
+    if chunk_length > 0:
+        transcriber = ChunkedBackend(transcriber, chunk_length)
+    if cache_dir is None:
+        return transcriber
+    return CachedBackend(transcriber, TranscriptionCache(cache_dir))
+
+
+def transcribe_and_segment(transcriber, audio, state=None, state_key="", stage="transcribe", metrics=None,
+                           min_segment_duration=0):
+    """
+    Transcribes the audio, removes hallucinations and splits the segments into clip-sized segments of at least
+    min_segment_duration seconds (see check_segments).
+    With a pipeline_state.PipelineState the transcription is saved as <stage>.json in the output folder and
+    reused when the stage was already completed for the same input (state_key) and models.
+    Timings go to the transcribe and segment stages of metrics.
+    """
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    with metrics.stage("transcribe"):
+        results = transcribe(transcriber, audio, state, state_key, stage)
+    with metrics.stage("segment"):
+        results = remove_hallucinations(results)
+        # Check segments duration and split them if they are longer than 10 seconds
+        return check_segments(results["segments"], min_segment_duration=min_segment_duration)
+
+
+def transcribe(transcriber, audio, state=None, state_key="", stage="transcribe"):
+    results = None
+    if state is not None:
+        key = params_hash(state_key, transcriber.model, transcriber.align_model, transcriber.language)
+        path = os.path.join(state.out_folder, stage + ".json")
+        if state.stage_done(stage, key) and os.path.exists(path):
+            print("Transcription already done in {0}, skipping it".format(path))
+            results = read_json(path)
+    if results is None:
+        results = transcriber.transcribe(audio, content_hash=state_key or None)
+        if state is not None:
+            with open(path, "w", encoding="utf8") as f:
+                json.dump(results, f, ensure_ascii=False)
+            state.complete_stage(stage, key)
+    return results
+
+
+def resolve_batch_inputs(spec):
+    """
+    Returns the list of inputs of a batch. spec is either a manifest file with one path per line
+    (empty lines and lines starting with # are ignored) or a glob pattern.
+    """
+    if os.path.isfile(spec) and not spec.lower().endswith(AUDIO_EXTENSIONS):
+        base = os.path.dirname(os.path.abspath(spec))
+        with open(spec, "r", encoding="utf8") as f:
+            lines = [line.strip() for line in f]
+        return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+    return sorted(glob.glob(spec))
 
-    for s, segment in enumerate(segments):
-        for i in range(len(segment["words"])):
-            if "start" not in segment["words"][i].keys() or "end" not in segment["words"][i].keys():
-                for j in range(i-1, -1, -1):
-                    if "start" in segment["words"][j].keys() and "end" in segment["words"][j].keys():
-                        segment["words"][i]["start"] = segment["words"][j]["start"]
-                        segment["words"][i]["end"] = segment["words"][j]["end"]
-                        print(f"Word {segment['words'][i]['word']} does not have start and end keys. Using word \"{segment['words'][j]['word']}\" timestamps.")
-                        break
-                segments_to_remove.append(s)
-                break
-    
-    segments = [segment for i, segment in enumerate(segments) if i not in segments_to_remove]
 
+def batch_main(inputs, name_run="batch", language="es", slicer="native", normalizer="ffmpeg", backend="whisperx",
+               cache_dir=DEFAULT_CACHE_DIR, chunk_length=0, refine_tolerance=0.0, executor="thread", workers=None,
+               output_format="wavs", path_prefix=DEFAULT_PATH_PREFIX, speaker=None, resume=None, queue_size=2,
+               metrics=None, metrics_json=None, min_segment_duration=0):
+    """
+    Processes several long recordings into a single dataset. A producer thread transcribes the inputs one
+    after another while the main thread cuts and normalizes the clips of the previous input, through a
+    bounded queue of queue_size transcribed inputs. All clips go to one output folder and one metadata.txt
+    with globally unique indices. metrics, metrics_json and min_segment_duration work as in main.
+    """
+    time = datetime.datetime.now()
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    if len(inputs) == 0:
+        raise Exception("The batch does not contain any input. Please check the manifest or pattern and try again.")
+    out_folder = (resume_folder(resume, os.path.abspath(name_run))
+                  or os.path.abspath(name_run) + datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.join(out_folder, "wavs") if output_format == "wavs" else out_folder, exist_ok=True)
+    state = PipelineState(out_folder, resume=bool(resume))
+    writer = DatasetWriter(out_folder, output_format, path_prefix, speaker)
+    transcriber = make_transcriber(backend, language, cache_dir, chunk_length)
+    transcribed = Queue(maxsize=queue_size)
+
+    def producer():
+        try:
+            for k, filepath in enumerate(inputs):
+                filepath, joined_audio = prepare_input(os.path.abspath(filepath), normalizer, metrics)
+                audio = joined_audio if joined_audio is not None else filepath
+                state_key = audio_hash(audio)
+                print("Transcribing audio file: {0}...".format(filepath))
+                segments = transcribe_and_segment(transcriber, audio, state, state_key, "transcribe_{0}".format(k),
+                                                  metrics, min_segment_duration)
+                transcribed.put((audio, segments, state_key))
+        except Exception as e:
+            transcribed.put(e)
+        transcribed.put(None)
+
+    Thread(target=producer, daemon=True).start()
+    index = 1
+    duration = 0
+    while True:
+        item = transcribed.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+        audio, checked_segments, state_key = item
+        duration += audio.duration if isinstance(audio, JoinedAudio) else get_audio_length(audio)
+        print("Cutting {0} into clips...".format(os.path.dirname(audio.sources[0]) if isinstance(audio, JoinedAudio) else audio))
+        index = cut_audio_and_generate_metadata(out_folder, audio, checked_segments, slicer, normalizer, index,
+                                                refine_tolerance, executor, workers, writer=writer, state=state,
+                                                state_key=state_key, metrics=metrics)
+    with metrics.stage("metadata"):
+        writer.close()
+    print("Done! {0} clips from {1} inputs in the folder {2}.".format(index - 1, len(inputs), out_folder))
+    seconds = datetime.datetime.now().timestamp() - time.timestamp()
+    timeMMSS = str(datetime.timedelta(seconds=seconds))
+    print("Total processing time: {0}. Audio duration: {1}. Processing speed: {2} real time".format(timeMMSS, str(datetime.timedelta(seconds=duration)), str(duration / seconds)[:4] + "x"))
+    metrics.audio_duration += duration
+    report_metrics(metrics, metrics_json)
+    return out_folder
+
+
+# Compact clip record: first_word/last_word are the [first, last) range of the clip's words in the flattened
+# word list of the transcript, speech_end is the end of the last word.
+Segment = namedtuple("Segment", ["start", "end", "text", "first_word", "last_word", "speech_end"])
+
+
+def check_segments(segments, max_segment_duration=10, min_segment_duration=0) -> List[Segment]:
+    """
+    Turns the whisperx segments into clip-sized Segment records in a single linear pass over the words.
+    Segments with words without timestamps are discarded. Segments longer than max_segment_duration are
+    split at the largest pauses between words that keep every piece under max_segment_duration (and, when
+    possible, over min_segment_duration). Clips with less than two words, with the same timestamp for their
+    two last or two first words, or shorter than min_segment_duration are removed.
+    """
     new_segments = []
+    word_offset = 0
     for segment in segments:
-        if segment["end"] - segment["start"] > max_segment_duration:
-            # Split the segment into smaller segments using the word timestamps to fill the new segment
-            segment_duration = segment["end"] - segment["start"]
-            n_splits = int(segment_duration / max_segment_duration)
-            # Now we find the middle points of the segment where we must split
-            splits_duration = segment_duration / (n_splits + 1)
-            split_points = [segment["start"] + splits_duration * (i + 1) for i in range(n_splits)]
-            # Now we create the new segments
-            new_segment = dict()
-            new_segment["start"] = segment["start"]
-            new_segment["end"] = 0
-            new_segment["text"] = ""
-            new_segment["words"] = []
-            current_split = 0
-            for word in segment["words"]:
-                # We keep adding words to the new segment until we reach a split point
-                if current_split == len(split_points):  # If we are on the last segment simply add the remaining words
-                    new_segment["words"].append(word)
-                    new_segment["text"] += word["word"] + " "
-                    new_segment["end"] = word["end"]
-                elif word["end"] < split_points[current_split]:  # Keep adding words that fit in the segment
-                    new_segment["words"].append(word)
-                    new_segment["text"] += word["word"] + " "
-                    new_segment["end"] = word["end"]
-                else:  # If we reached the end of the segment, add the segment to the list and start a new one
-                    new_segments.append(new_segment)
-                    new_segment = dict()
-                    new_segment["start"] = word["start"]
-                    new_segment["text"] = ""
-                    new_segment["words"] = []
-                    new_segment["words"].append(word)
-                    new_segment["text"] += word["word"] + " "
-                    new_segment["end"] = word["end"]
-                    current_split += 1
-            new_segments.append(new_segment)
+        words = segment["words"]
+        first_word = word_offset
+        word_offset += len(words)
+        if not all("start" in word and "end" in word for word in words):
+            print("Segment \"{0}\" has words without timestamps, skipping it.".format(segment["text"].strip()))
+            continue
+        if len(words) < 2:
+            continue
+        if segment["end"] - segment["start"] <= max_segment_duration:
+            pieces = [(0, len(words), segment["start"], segment["end"], segment["text"])]
         else:
-            new_segments.append(segment)
-
-    # Remove segments with only one word
-    new_segments = [segment for segment in new_segments if len(segment["words"]) > 1]
-    #if a segment has their two last words with the same timestamp, remove the segment:
-    new_segments = [segment for segment in new_segments if segment["words"][len(segment["words"]) - 1]["end"] != segment["words"][len(segment["words"]) - 2]["end"]]
-    #repeat the same for the start of the segment
-    new_segments = [segment for segment in new_segments if segment["words"][0]["start"] != segment["words"][1]["start"]]
+            pieces = split_segment(words, segment["start"], max_segment_duration, min_segment_duration)
+        for a, b, start, end, text in pieces:
+            if b - a < 2 or words[b - 1]["end"] == words[b - 2]["end"] or words[a]["start"] == words[a + 1]["start"]:
+                continue
+            if (words[b - 1]["end"] + end) / 2 - start < min_segment_duration:
+                continue
+            new_segments.append(Segment(start, end, text, first_word + a, first_word + b, words[b - 1]["end"]))
     return new_segments
 
 
-def cut_and_normalize_segment(audiopath, text, start, end, outfile, index ,fileObject, semaphore):
-        subprocess.run(
-                ['ffmpeg', '-i', audiopath, '-ss', str(start), '-to', str(end), outfile, '-loglevel', 'error', '-y',
-                 '-hide_banner'])
-        normalize_audio(outfile)
-        cleaned_text = multilingual_cleaners(text)
-        semaphore.acquire()
-        fileObject.write('/content/tacotron2/wavs/{0}.wav|{1}\n'.format(str(index), cleaned_text))
-        semaphore.release()
+def split_segment(words, start, max_segment_duration, min_segment_duration=0):
+    """
+    Splits the words of a segment into pieces no longer than max_segment_duration, cutting at the largest
+    pause available each time a piece would overflow. The candidate pauses of the current piece are kept in
+    a monotonic deque (largest first), so every word is pushed and popped at most once.
+    Returns (first, last, start, end, text) tuples with [first, last) word ranges.
+    """
+    pieces = []
+    piece_first = 0
+    piece_start = start
+    candidates = deque()  # split positions j (between words j-1 and j), decreasing pause length
+    gaps = [0.0] * len(words)
+    for j in range(1, len(words)):
+        gaps[j] = words[j]["start"] - words[j - 1]["end"]
+        while candidates and gaps[candidates[-1]] <= gaps[j]:
+            candidates.pop()
+        candidates.append(j)
+        while words[j]["end"] - piece_start > max_segment_duration and piece_first < j:
+            # Pauses that would leave a piece shorter than min_segment_duration are discarded
+            while candidates and words[candidates[0] - 1]["end"] - piece_start < min_segment_duration:
+                candidates.popleft()
+            cut = candidates.popleft() if candidates else j
+            pieces.append((piece_first, cut, piece_start, words[cut - 1]["end"],
+                           " ".join(word["word"] for word in words[piece_first:cut])))
+            piece_first = cut
+            piece_start = words[cut]["start"]
+            while candidates and candidates[0] <= cut:
+                candidates.popleft()
+    pieces.append((piece_first, len(words), piece_start, words[-1]["end"],
+                   " ".join(word["word"] for word in words[piece_first:])))
+    return pieces
 
 
-def cut_audio_and_generate_metadata(out_folder: str, audio_path: str, segments) -> None:
-    sem = Semaphore(1)
+def cut_and_normalize_segment(audiopath, text, start, end, outfile, index, normalizer="ffmpeg") -> ClipResult:
+    """
+    Cuts the segment with ffmpeg and normalizes it.
+    """
+    run_subprocess(
+            ['ffmpeg', '-i', audiopath, '-ss', str(start), '-to', str(end), outfile, '-loglevel', 'error', '-y',
+             '-hide_banner'])
+    normalize_audio(outfile, normalizer)
+    info = read_wav_info(outfile)
+    return ClipResult(index, text, multilingual_cleaners(text), info.n_frames / info.sample_rate, None)
+
+
+def slice_and_normalize_segment(clip, sample_rate, text, outfile, index, normalizer="ffmpeg") -> ClipResult:
+    """
+    Same as cut_and_normalize_segment for a clip already sliced in-process from the decoded
+    (or memory-mapped) source audio instead of launching ffmpeg to seek and cut it.
+    With normalizer="native" the clip is also normalized in memory and written to disk only once.
+    With outfile=None nothing is written and the normalized samples are returned for the shard writer
+    (always normalized in memory).
+    """
+    cleaned_text = multilingual_cleaners(text)
+    if outfile is None:
+        samples = normalize_array(clip, sample_rate)
+        return ClipResult(index, text, cleaned_text, len(samples) / TARGET_SAMPLE_RATE, samples)
+    if normalizer == "native":
+        samples = normalize_array(clip, sample_rate)
+        write_wav(outfile, samples, TARGET_SAMPLE_RATE)
+        return ClipResult(index, text, cleaned_text, len(samples) / TARGET_SAMPLE_RATE, None)
+    write_wav(outfile, clip, sample_rate)
+    normalize_audio(outfile, normalizer)
+    info = read_wav_info(outfile)
+    return ClipResult(index, text, cleaned_text, info.n_frames / info.sample_rate, None)
+
+
+def run_chunk(function, chunk):
+    return [function(*args) for args in chunk]
+
+
+def run_ordered(function, tasks, executor="thread", workers=None, chunksize=8):
+    """
+    Runs function(*task) for every task on a pool of workers and yields the results in task order.
+    executor is "thread" or "process", workers defaults to the number of cores. Tasks are consumed
+    lazily and submitted in chunks of chunksize, with at most two chunks per worker in flight, so
+    memory stays bounded and process pools do one round trip per chunk instead of one per task.
+    """
+    workers = workers or os.cpu_count() or 1
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=workers)
+    elif executor == "process":
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError("Unknown executor {0}. Options: thread, process".format(executor))
+    with pool:
+        pending = deque()
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) == chunksize:
+                pending.append(pool.submit(run_chunk, function, chunk))
+                chunk = []
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        if chunk:
+            pending.append(pool.submit(run_chunk, function, chunk))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def cut_audio_and_generate_metadata(out_folder: str, audio_path, segments, slicer="native",
+                                    normalizer="ffmpeg", first_index=1, refine_tolerance=0.0, executor="thread",
+                                    workers=None, chunksize=8, writer=None, state=None, state_key="",
+                                    metrics=None) -> int:
+    """
+    Cuts the audio file into one clip per segment and writes metadata.txt and clip_sources.txt, which
+    records the source file and timestamps of every clip.
+    audio_path can also be a JoinedAudio stream, in that case the clips are always sliced in-process.
+    Clips are numbered from first_index; with first_index > 1 both files are appended to instead of
+    overwritten, and the manifest and split files of the own writer are merged with the existing ones (see
+    DatasetWriter append). Returns the next free clip index.
+    slicer="native" memory-maps the source WAV once and slices every clip by sample offset,
+    slicer="ffmpeg" launches one ffmpeg process per clip. The native slicer falls back to ffmpeg
+    when the source cannot be mapped (not a WAV file, compressed or 24 bit audio...).
+    normalizer is passed to utils.normalize_audio (ffmpeg or native).
+    With refine_tolerance > 0 every start (end) is moved to the nearest silence at most refine_tolerance seconds
+    before (after) it, using an energy envelope computed once over the whole source (only when it is sliced
+    in-process).
+    The clips are processed by run_ordered (executor, workers, chunksize) and handed in index order to
+    writer, a dataset_export.DatasetWriter. Without writer a wavs/ + metadata.txt writer is created and
+    closed, which also writes the manifest and the train/val split files.
+    With a pipeline_state.PipelineState, wav clips already produced from the same input (state_key) and
+    parameters are kept instead of cut again, and every new clip is recorded in the state.
+    Timings go to the cut and metadata stages of metrics, with the latency of every clip. The cut stage includes
+    the normalization of every clip: for single files all the normalization time is here, for folders it is split
+    between the normalize stage of prepare_input (whole files) and this one (clips).
+    """
+    metrics = metrics if metrics is not None else PipelineMetrics()
+    with metrics.stage("cut"):
+        return cut_clips(out_folder, audio_path, segments, slicer, normalizer, first_index, refine_tolerance,
+                         executor, workers, chunksize, writer, state, state_key, metrics)
+
+
+def cut_clips(out_folder, audio_path, segments, slicer, normalizer, first_index, refine_tolerance, executor, workers,
+              chunksize, writer, state, state_key, metrics):
+    own_writer = writer is None
+    if own_writer:
+        writer = DatasetWriter(out_folder, append=first_index > 1)
+    samples = None
+    if isinstance(audio_path, JoinedAudio):
+        samples, sample_rate = audio_path, audio_path.sample_rate
+    elif slicer == "native":
+        try:
+            samples, sample_rate = open_wav(audio_path)
+        except ValueError as e:
+            print("Could not map {0} ({1}), falling back to ffmpeg to cut the clips".format(audio_path, e))
+    elif slicer != "ffmpeg":
+        raise ValueError("Unknown slicer {0}. Options: native, ffmpeg".format(slicer))
+    if samples is None and writer.output_format == "shards":
+        # Shards are written from memory: decode the whole source once instead of cutting files
+        samples, sample_rate = decode_audio(audio_path)
+
+    starts = [segment.start for segment in segments]
+    ends = [(segment.speech_end + segment.end) / 2 for segment in segments]
+    if refine_tolerance > 0:
+        if samples is not None:
+            energy = frame_energy(samples, sample_rate, VAD_FRAME_LENGTH)
+            starts, ends = refine_cuts(starts, ends, silence_mask(energy), VAD_FRAME_LENGTH, refine_tolerance)
+        else:
+            print("Cut refinement needs the source sliced in-process, keeping the transcription timestamps")
+
+    clips = [(first_index + i, float(start), float(end), segment.text)
+             for i, (segment, start, end) in enumerate(zip(segments, starts, ends))]
+    sources = clip_sources(audio_path, clips)
+    mode = "w" if first_index == 1 else "a"
+    with metrics.stage("metadata"):
+        write_clip_sources(os.path.join(out_folder, CLIP_SOURCES_FILE), clips, sources, mode)
+
+    def outfile(index):
+        if writer.output_format == "shards":
+            return None
+        return os.path.join(out_folder, "wavs", str(index) + ".wav")
+
+    keys = [params_hash(state_key, start, end, text, slicer, normalizer) for _, start, end, text in clips]
+    done = [None] * len(clips)
+    if state is not None and writer.output_format == "wavs":
+        done = [state.clip_done(index, key, outfile(index)) for (index, _, _, _), key in zip(clips, keys)]
+        if any(done):
+            print("Keeping {0} clips from the previous run".format(sum(clip is not None for clip in done)))
+    pending = [clip for clip, result in zip(clips, done) if result is None]
+
+    if samples is not None:
+        cut_function = slice_and_normalize_segment
+        tasks = ((cut_function, slice_seconds(samples, sample_rate, start, end), sample_rate, text, outfile(index),
+                  index, normalizer) for index, start, end, text in pending)
+    else:
+        cut_function = cut_and_normalize_segment
+        tasks = ((cut_function, audio_path, text, start, end, outfile(index), index, normalizer)
+                 for index, start, end, text in pending)
+
+    # timed_call runs in the workers and returns the latency of every clip along with its result
+    results = run_ordered(timed_call, tasks, executor, workers, chunksize)
+    with tqdm(total=len(clips)) as pbar: # type: ignore
+        for previous, source, key in zip(done, sources, keys):
+            clip = previous if previous is not None else metrics.record_clip(next(results))
+            with metrics.stage("metadata"):
+                writer.add(clip, *source)
+                if state is not None and previous is None and writer.output_format == "wavs":
+                    state.complete_clip(clip, key, outfile(clip.index))
+            pbar.update(1)
+    with metrics.stage("metadata"):
+        writer.flush()
+        if state is not None:
+            state.save()
+        if own_writer:
+            writer.close()
+    return first_index + len(clips)
+
+
+def clip_sources(audio_path, clips):
+    """
+    Returns (source file, start, end) for every (index, start, end, text) clip, with the timestamps relative to
+    the source file. For JoinedAudio streams the source file is looked up in the stream's offset map.
+    """
+    sources = []
+    for index, start, end, _ in clips:
+        if isinstance(audio_path, JoinedAudio):
+            source, source_start = audio_path.locate(start)
+        else:
+            source, source_start = audio_path, start
+        sources.append((source, source_start, source_start + end - start))
+    return sources
+
+
+def write_clip_sources(path, clips, sources, mode="w"):
+    """
+    Writes index|source file|start|end for every clip.
+    """
+    with open(path, mode, encoding="utf8") as f:
+        for (index, _, _, _), (source, source_start, source_end) in zip(clips, sources):
+            f.write("{0}|{1}|{2:.3f}|{3:.3f}\n".format(index, source, source_start, source_end))
 
-    work_list = []
-    index = 1
-    f = open(os.path.join(out_folder, "metadata.txt"), "w", encoding='utf8')
-    for segment in segments:
-        start = segment["start"]
-        end = (segment["words"][len(segment["words"]) - 1]["end"] + segment["end"]) / 2
-        outfile = os.path.join(out_folder, "wavs", str(index) + ".wav")
-        work_list.append((audio_path, segment["text"], start, end, outfile, index, f, sem))
-        index += 1
-
-    with tqdm(total=len(work_list)) as pbar: # type: ignore
-        with ThreadPoolExecutor(max_workers=8) as ex:
-            futures = [ex.submit(cut_and_normalize_segment, *args) for args in work_list]
-            for future in as_completed(futures):
-                pbar.update(1)
-    f.close()
-
-
-# TODO: could modify easily by iterating over copy of results and discard each segment that is a hallucination
-def remove_end_hallucinations(results):  # https://github.com/openai/whisper/discussions/928
-    hallucinations = set(read_json(os.path.abspath("hallucination_sentences.json"))['hallucinations'])
-    if results["segments"][len(results["segments"]) - 1]["text"] in hallucinations:
-        del results["segments"][len(results["segments"]) - 1]
-    return results
 
 def copy_audio_list_to_tmp_folder(audio_list):
     #create tmp folder
@@ -225,19 +555,76 @@ def force_cudnn_initialization():
 if __name__ == "__main__":
     argparse = argparse.ArgumentParser(
         description='Script to transcribe and cut long audio files into short clips using OpenAI Whisper and ffmpeg.')
-    argparse.add_argument('-f', '--filepath', type=str, required=True, help="Path to the audio file or folder to transcribe.")
+    inputs = argparse.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('-f', '--filepath', type=str, help="Path to the audio file or folder to transcribe.")
+    inputs.add_argument('--batch', type=str,
+                        help='Manifest file (one path per line) or glob pattern of the audio files or folders to'
+                             + ' process into a single dataset. Transcription of each input overlaps with the cutting'
+                             + ' of the previous one.')
     
     argparse.add_argument('-l', '--language', type=str, default="es", required=False,
                           help='Language code of the audio file. Default is Spanish (es). English not supported yet.')
     argparse.add_argument('-n', '--name_run', type=str, default="run", required=False,
                           help='Name of the execution. Default is filename+timestamp. This will be name of the output folder together'
                                + ' with the date and time of the execution.')
+    argparse.add_argument('-s', '--slicer', type=str, default="native", required=False, choices=["native", "ffmpeg"],
+                          help='How to cut the clips. native slices the memory-mapped wav in-process, ffmpeg launches'
+                               + ' one ffmpeg process per clip. Default is native.')
+    argparse.add_argument('-e', '--normalizer', type=str, default="ffmpeg", required=False, choices=["ffmpeg", "native"],
+                          help='Normalization engine. native resamples and normalizes in memory without launching'
+                               + ' ffmpeg. Default is ffmpeg.')
+    argparse.add_argument('-b', '--backend', type=str, default="whisperx", required=False, choices=available_backends(),
+                          help='Transcription backend. whisperx keeps the models loaded in-process, cli launches the'
+                               + ' whisperx command line tool. Default is whisperx.')
+    argparse.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, required=False,
+                          help='Directory of the transcription cache. Inputs whose audio was already transcribed with the'
+                               + ' same models and language are not transcribed again.')
+    argparse.add_argument('--no_cache', action='store_true', help='Do not read or write the transcription cache.')
+    argparse.add_argument('--chunk_length', type=float, default=0, required=False,
+                          help='Transcribe in windows of about this many seconds, split at silences and checkpointed so'
+                               + ' an interrupted run resumes where it stopped. Default is 0 (whole file at once).')
+    argparse.add_argument('--refine_cuts', type=float, default=0, required=False,
+                          help='Move the start (end) of every clip to the nearest silence at most this many seconds'
+                               + ' before (after) it. Default is 0 (use the transcription timestamps).')
+    argparse.add_argument('--min_segment_duration', type=float, default=0, required=False,
+                          help='Drop clips shorter than this many seconds and avoid splitting long segments into pieces'
+                               + ' shorter than it. Default is 0 (keep every clip).')
+    argparse.add_argument('--executor', type=str, default="thread", required=False, choices=["thread", "process"],
+                          help='Worker pool used to cut and normalize the clips. Default is thread.')
+    argparse.add_argument('-w', '--workers', type=int, default=None, required=False,
+                          help='Number of clip workers. Default is the number of cores.')
+    argparse.add_argument('-o', '--output_format', type=str, default="wavs", required=False, choices=["wavs", "shards"],
+                          help='wavs writes one wav file per clip, shards packs the clips into a few large PCM files.'
+                               + ' Both write manifest.parquet (or .csv) and train.txt/val.txt. Default is wavs.')
+    argparse.add_argument('--path_prefix', type=str, default=DEFAULT_PATH_PREFIX, required=False,
+                          help='Prefix of the clip paths in metadata.txt and the split files. Default is '
+                               + DEFAULT_PATH_PREFIX)
+    argparse.add_argument('--speaker', type=str, default=None, required=False,
+                          help='Speaker name stored in the manifest. Default is the output folder name.')
+    argparse.add_argument('--resume', type=str, nargs='?', const="last", default=None, required=False,
+                          help='Complete a previous run instead of starting a new one: skip the finished transcription'
+                               + ' and the existing clips whose inputs and parameters did not change. Takes the output'
+                               + ' folder to resume, by default the last run with the same name.')
+    argparse.add_argument('--metrics_json', '--metrics-json', type=str, default=None, required=False,
+                          help='Write the per-stage metrics of the run (wall and CPU time, subprocesses, bytes read and'
+                               + ' written, peak memory, clip latency percentiles) to this JSON file.')
     args = argparse.parse_args()
+    cache_dir = None if args.no_cache else args.cache_dir
+    if torch.cuda.is_available():
+        force_cudnn_initialization()  # Trick to avoid CUDNN_STATUS_NOT_INITIALIZED error when running some models
+    if args.batch:
+        name_run = "batch" if args.name_run == "run" else args.name_run
+        batch_main(resolve_batch_inputs(args.batch), name_run, args.language, args.slicer, args.normalizer,
+                   args.backend, cache_dir, args.chunk_length, args.refine_cuts, args.executor, args.workers,
+                   args.output_format, args.path_prefix, args.speaker, args.resume,
+                   metrics_json=args.metrics_json, min_segment_duration=args.min_segment_duration)
+        exit(0)
     # Check that args.filepath file name does not contain any spaces or special characters using regex
     filename = args.filepath.split("\\")[-1]
     if re.search(r'[^A-Za-z0-9_\.]+', filename):
         raise Exception("File name contains special characters or spaces. Please rename the file and try again.")
     if not os.path.isabs(args.filepath):
         args.filepath = os.path.abspath(args.filepath)
-    force_cudnn_initialization()  # Trick to avoid CUDNN_STATUS_NOT_INITIALIZED error when running some models
-    main(args.filepath, args.name_run, args.language)
+    main(args.filepath, args.name_run, args.language, args.slicer, args.normalizer, args.backend, cache_dir,
+         args.chunk_length, args.refine_cuts, args.executor, args.workers, args.output_format, args.path_prefix,
+         args.speaker, args.resume, metrics_json=args.metrics_json, min_segment_duration=args.min_segment_duration)
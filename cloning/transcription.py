@@ -0,0 +1,158 @@
+import os
+import tempfile
+from threading import Lock
+
+import numpy as np
+
+from audio_io import decode_audio, open_wav, write_wav
+from audio_join import JoinedAudio
+from audio_norm import resample, to_mono
+from metrics import run_subprocess
+from utils import read_json
+
+WHISPER_SAMPLE_RATE = 16000
+DEFAULT_MODEL = "medium"
+DEFAULT_ALIGN_MODEL = "VOXPOPULI_ASR_BASE_10K_ES"
+
+# Process-wide cache of loaded models, keyed by (kind, model name, language, device)
+_MODEL_CACHE = dict()
+_MODEL_CACHE_LOCK = Lock()
+
+_BACKENDS = dict()
+
+
+def default_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def cached_model(key, loader):
+    """
+    Returns the model stored in the process-wide cache under key, loading it with loader() the first time.
+    """
+    with _MODEL_CACHE_LOCK:
+        if key not in _MODEL_CACHE:
+            _MODEL_CACHE[key] = loader()
+        return _MODEL_CACHE[key]
+
+
+def clear_model_cache():
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE.clear()
+
+
+def load_audio_16k(audio):
+    """
+    Returns the audio as the mono float32 16 kHz array whisper expects.
+    audio can be a path, a JoinedAudio stream or a (samples, sample_rate) tuple.
+    """
+    if isinstance(audio, JoinedAudio):
+        samples, sample_rate = audio[0:len(audio)], audio.sample_rate
+    elif isinstance(audio, tuple):
+        samples, sample_rate = audio
+    else:
+        try:
+            samples, sample_rate = open_wav(audio)
+        except ValueError:
+            samples, sample_rate = decode_audio(audio, WHISPER_SAMPLE_RATE, 1)
+    return resample(to_mono(samples), sample_rate, WHISPER_SAMPLE_RATE)
+
+
+class TranscriptionBackend:
+    """
+    Base class of the transcription backends. transcribe() receives a path, a JoinedAudio stream or a
+    (samples, sample_rate) tuple and returns the whisperx result dict ({"segments": [...]}) with word timestamps.
+    content_hash is the transcription_cache.audio_hash of the audio when the caller already computed it, so
+    wrappers that key on the content (CachedBackend, ChunkedBackend) do not hash the whole recording again.
+    """
+    name = None
+
+    def __init__(self, model=DEFAULT_MODEL, align_model=DEFAULT_ALIGN_MODEL, language="es", device=None):
+        self.model = model
+        self.align_model = align_model
+        self.language = language
+        self.device = device
+
+    def transcribe(self, audio, content_hash=None) -> dict:
+        raise NotImplementedError
+
+
+def register_backend(name):
+    """
+    Class decorator that makes a backend available to get_backend() under the given name.
+    Tests can register a small fake backend to run the pipeline on CPU-only machines.
+    """
+    def decorator(cls):
+        cls.name = name
+        _BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def get_backend(name, **kwargs) -> TranscriptionBackend:
+    if name not in _BACKENDS:
+        raise ValueError("Unknown transcription backend {0}. Options: {1}".format(name, ", ".join(_BACKENDS)))
+    return _BACKENDS[name](**kwargs)
+
+
+def available_backends():
+    return list(_BACKENDS)
+
+
+@register_backend("whisperx")
+class WhisperXBackend(TranscriptionBackend):
+    """
+    Calls the whisperx Python API in-process. The ASR and alignment models are loaded once per process
+    and reused by every call with the same model, language and device.
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, align_model=DEFAULT_ALIGN_MODEL, language="es", device=None,
+                 batch_size=16, compute_type=None):
+        super().__init__(model, align_model, language, device or default_device())
+        self.batch_size = batch_size
+        self.compute_type = compute_type or ("float16" if self.device == "cuda" else "int8")
+
+    def asr_model(self):
+        import whisperx
+        return cached_model(("asr", self.model, self.language, self.device, self.compute_type),
+                            lambda: whisperx.load_model(self.model, self.device, compute_type=self.compute_type,
+                                                        language=self.language))
+
+    def alignment_model(self):
+        import whisperx
+        return cached_model(("align", self.align_model, self.language, self.device),
+                            lambda: whisperx.load_align_model(language_code=self.language, device=self.device,
+                                                              model_name=self.align_model))
+
+    def transcribe(self, audio, content_hash=None) -> dict:
+        import whisperx
+        audio = load_audio_16k(audio)
+        result = self.asr_model().transcribe(audio, batch_size=self.batch_size, language=self.language)
+        align_model, metadata = self.alignment_model()
+        return whisperx.align(result["segments"], align_model, metadata, audio, self.device,
+                              return_char_alignments=False)
+
+
+@register_backend("cli")
+class WhisperXCLIBackend(TranscriptionBackend):
+    """
+    Launches the whisperx command line tool and reads back its JSON output. Every call loads the models again.
+    """
+
+    def transcribe(self, audio, content_hash=None) -> dict:
+        with tempfile.TemporaryDirectory() as tmp:
+            if isinstance(audio, JoinedAudio):
+                path = os.path.join(tmp, "joined_audio.wav")
+                audio.write(path)
+            elif isinstance(audio, tuple):
+                path = os.path.join(tmp, "audio.wav")
+                write_wav(path, np.asarray(audio[0]), audio[1])
+            else:
+                path = audio
+            command = ["whisperx", path, "--model", self.model, "--align_model", self.align_model,
+                       "--language", self.language, "--output_format", "json", "--output_dir", tmp]
+            if self.device:
+                command += ["--device", self.device]
+            run_subprocess(command)
+            filename = os.path.splitext(os.path.basename(path))[0] + ".json"
+            return read_json(os.path.join(tmp, filename))
@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from audio_io import open_wav
+from audio_join import JoinedAudio
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tfg", "transcriptions")
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # 2 GB
+
+
+def audio_hash(audio):
+    """
+    Content hash of the audio samples. audio can be a path to a WAV file, a JoinedAudio stream or
+    a (samples, sample_rate) tuple. Files that cannot be mapped are hashed byte by byte.
+    """
+    h = hashlib.sha256()
+    if isinstance(audio, JoinedAudio):
+        h.update(str(audio.sample_rate).encode())
+        for block in audio.stream():
+            h.update(np.ascontiguousarray(block).tobytes())
+        return h.hexdigest()
+    if isinstance(audio, tuple):
+        samples, sample_rate = audio
+    else:
+        try:
+            samples, sample_rate = open_wav(audio)
+        except ValueError:
+            with open(audio, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            return h.hexdigest()
+    h.update(str(sample_rate).encode())
+    for i in range(0, len(samples), 1 << 20):
+        h.update(np.ascontiguousarray(samples[i:i + (1 << 20)]).tobytes())
+    return h.hexdigest()
+
+
+class TranscriptionCache:
+    """
+    On-disk cache of whisperx results. Every entry is a JSON file named after the hash of the audio
+    content, the ASR model, the alignment model and the language. The modification time of an entry is
+    updated on every hit, so eviction removes the least recently used entries first.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash, model, align_model, language):
+        return hashlib.sha256("|".join([content_hash, model, align_model, language]).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "r", encoding="utf8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(self.path(key))
+        return entry["results"]
+
+    def put(self, key, results, info=None):
+        tmp_path = self.path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"info": info or dict(), "results": results}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """
+        Returns (key, size in bytes, last access time) of every entry, least recently used first.
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((filename[:-len(".json")], stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def info(self, key):
+        with open(self.path(key), "r", encoding="utf8") as f:
+            return json.load(f)["info"]
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, max_size=None):
+        """
+        Removes least recently used entries until the cache fits in max_size bytes. Returns the removed keys.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        removed = []
+        for key, size, _ in entries:
+            if total <= max_size:
+                break
+            os.remove(self.path(key))
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
+
+class CachedBackend:
+    """
+    Wraps a transcription backend so results are read from the cache when the same audio was already
+    transcribed with the same model, alignment model and language.
+    """
+
+    def __init__(self, backend, cache: TranscriptionCache):
+        self.backend = backend
+        self.cache = cache
+
+    def __getattr__(self, item):
+        # Expose model, align_model, language... of the wrapped backend
+        return getattr(self.backend, item)
+
+    def transcribe(self, audio, content_hash=None) -> dict:
+        content_hash = content_hash or audio_hash(audio)
+        key = TranscriptionCache.key(content_hash, self.backend.model, self.backend.align_model, self.backend.language)
+        results = self.cache.get(key)
+        if results is not None:
+            print("Transcription found in cache ({0}), skipping transcription".format(key[:12]))
+            return results
+        results = self.backend.transcribe(audio, content_hash=content_hash)
+        source = audio.sources if isinstance(audio, JoinedAudio) else audio if isinstance(audio, str) else None
+        self.cache.put(key, results, {"audio_hash": content_hash, "model": self.backend.model,
+                                      "align_model": self.backend.align_model, "language": self.backend.language,
+                                      "source": source})
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect and prune the on-disk transcription cache')
+    parser.add_argument('-d', '--directory', type=str, default=DEFAULT_CACHE_DIR, help='Cache directory', required=False)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the cached transcriptions, least recently used first")
+    prune = subparsers.add_parser("prune", help="Remove least recently used entries until the cache fits")
+    prune.add_argument('-s', '--max_size', type=float, required=True, help='Maximum cache size in MB')
+    subparsers.add_parser("clear", help="Remove every entry")
+    args = parser.parse_args()
+
+    cache = TranscriptionCache(args.directory)
+    if args.command == "list":
+        entries = cache.entries()
+        for key, size, _ in entries:
+            info = cache.info(key)
+            print("{0}  {1:8.1f} KB  {2} {3} {4}  {5}".format(key[:12], size / 1024, info.get("model"),
+                                                              info.get("align_model"), info.get("language"),
+                                                              info.get("source")))
+        print("{0} entries, {1:.1f} MB".format(len(entries), sum(e[1] for e in entries) / 1024 ** 2))
+    elif args.command == "prune":
+        removed = cache.evict(int(args.max_size * 1024 ** 2))
+        print("Removed {0} entries, cache size is now {1:.1f} MB".format(len(removed), cache.size() / 1024 ** 2))
+    elif args.command == "clear":
+        print("Removed {0} entries".format(len(cache.clear())))
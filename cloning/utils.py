@@ -3,6 +3,10 @@ import os
 import re
 import statistics
 import subprocess
+from functools import lru_cache
+
+from audio_io import read_wav_info
+from metrics import run_subprocess
 
 try:
     from tqdm import tqdm
@@ -11,6 +15,20 @@ except:
     tqdm = lambda x: x
 
 _whitespace_re = re.compile(r"\s+")
+_number_re = re.compile(r"\d+")
+# replace_symbols and remove_aux_symbols as a single translation table. All the symbols are ASCII and UTF-8
+# never uses ASCII bytes inside multibyte characters, so the table is applied to the UTF-8 bytes, which is
+# much faster than str.translate on non-ASCII text.
+_cleaner_table = bytes.maketrans(b";-:", b", ,")
+_cleaner_deleted = b'<>()[]"'
+
+
+def translate_symbols(text):
+    return text.encode("utf8").translate(_cleaner_table, _cleaner_deleted).decode("utf8")
+
+_ending_punctuation = frozenset(['"', "'", '.', '。', ',', '，', '!', '！', '?', '？', ':', '：', '”', ')', ']', '}',
+                                 '、', ')'])
+_batch_separator = "\x00"
 
 
 def read_json(path):
@@ -18,68 +36,130 @@ def read_json(path):
         return json.load(f)
 
 
-def normalize_audio(filepath):
+def normalize_audio(filepath, engine="ffmpeg"):
     """
     Warning: This function will delete the original file
     This function normalizes the audio file and removes silence from the start and end of the file.
     It will also convert the file to mono, 16 bit 22050 Hz wav file.
+    engine="ffmpeg" runs two ffmpeg passes through a temporary file, engine="native" does the same
+    in memory with audio_norm (falls back to ffmpeg for files that are not plain WAV).
     """
 
     # First we transform the audio file into mono, 16 bit 22050 Hz wav file
     # Set outfile to the same as filepath but change the extension to .wav
     filename = os.path.basename(filepath).split(".")[0] + ".wav"
     dirname = os.path.dirname(filepath)
+    if engine == "native":
+        from audio_io import open_wav
+        from audio_norm import normalize_array, TARGET_SAMPLE_RATE
+        try:
+            samples, sample_rate = open_wav(filepath, mmap=False)
+        except ValueError:
+            return normalize_audio(filepath, "ffmpeg")
+        replace_with_wav(filepath, normalize_array(samples, sample_rate), TARGET_SAMPLE_RATE)
+        return
+    elif engine != "ffmpeg":
+        raise ValueError("Unknown normalization engine {0}. Options: ffmpeg, native".format(engine))
     filepath = os.path.join(dirname, filename)
-    subprocess.run(["ffmpeg", "-i", filepath, "-ac", "1", "-ar", "22050", "-acodec", "pcm_s16le",
+    run_subprocess(["ffmpeg", "-i", filepath, "-ac", "1", "-ar", "22050", "-acodec", "pcm_s16le",
                     filepath.replace(".wav", "tmp1.wav"), "-y", "-loglevel", "error", "-hide_banner"])
 
     os.remove(filepath)
 
     # Now we normalize the audio file
     # command: ffmpeg -i in.wav -filter:a "speechnorm=e=6" out.wav
-    subprocess.run(["ffmpeg", "-i", filepath.replace(".wav", "tmp1.wav"), "-filter:a", 'speechnorm=e=6',
+    run_subprocess(["ffmpeg", "-i", filepath.replace(".wav", "tmp1.wav"), "-filter:a", 'speechnorm=e=6',
                     filepath, "-y", "-loglevel", "error", "-hide_banner"])
 
     os.remove(filepath.replace(".wav", "tmp1.wav"))
 
 
-def normalize_folder(folderpath, verbose=False):
+def replace_with_wav(path, samples, sample_rate):
+    """
+    Writes samples as the .wav file with the name of path and removes path if it was another file (X.mp3, or X.WAV
+    on case sensitive filesystems). The audio is written to a temporary file first and moved over the target, so
+    X.WAV and X.wav being the same file on Windows and macOS never deletes the new clip.
+    """
+    from audio_io import write_wav
+    out_path = os.path.join(os.path.dirname(path), os.path.basename(path).split(".")[0] + ".wav")
+    same_file = os.path.exists(out_path) and os.path.samefile(path, out_path)
+    tmp_path = out_path + ".tmp"
+    write_wav(tmp_path, samples, sample_rate)
+    os.replace(tmp_path, out_path)
+    if not same_file:
+        os.remove(path)
+
+
+def normalize_folder(folderpath, verbose=False, engine="ffmpeg", batch_size=32):
     """
     This function normalizes all the audio files in a folder.
+    With engine="native" the WAV files are decoded and normalized in batches of batch_size buffers.
     """
     print("Normalizing all wav files in folder {0}".format(folderpath))
     bar = tqdm
     if not verbose:
         bar = lambda x: x
-    for filename in bar(os.listdir(folderpath)):
-        if filename.endswith(".wav") or filename.endswith(".WAV") \
-                or filename.endswith(".mp3") or filename.endswith(".MP3") \
-                or filename.endswith(".m4a") or filename.endswith(".M4A") \
-                or filename.endswith(".flac") or filename.endswith(".FLAC") \
-                or filename.endswith(".ogg") or filename.endswith(".OGG"):
-            normalize_audio(os.path.join(folderpath, filename))
+    filenames = [filename for filename in os.listdir(folderpath)
+                 if filename.endswith(".wav") or filename.endswith(".WAV")
+                 or filename.endswith(".mp3") or filename.endswith(".MP3")
+                 or filename.endswith(".m4a") or filename.endswith(".M4A")
+                 or filename.endswith(".flac") or filename.endswith(".FLAC")
+                 or filename.endswith(".ogg") or filename.endswith(".OGG")]
+    if engine != "native":
+        for filename in bar(filenames):
+            normalize_audio(os.path.join(folderpath, filename), engine)
+        return
+
+    from audio_io import open_wav
+    from audio_norm import normalize_batch, TARGET_SAMPLE_RATE
+    batches = [filenames[i:i + batch_size] for i in range(0, len(filenames), batch_size)]
+    for batch in bar(batches):
+        paths, buffers, sample_rates = [], [], []
+        for filename in batch:
+            try:
+                samples, sample_rate = open_wav(os.path.join(folderpath, filename), mmap=False)
+            except ValueError:
+                normalize_audio(os.path.join(folderpath, filename), "ffmpeg")
+                continue
+            paths.append(os.path.join(folderpath, filename))
+            buffers.append(samples)
+            sample_rates.append(sample_rate)
+        for path, normalized in zip(paths, normalize_batch(buffers, sample_rates, workers=os.cpu_count())):
+            replace_with_wav(path, normalized, TARGET_SAMPLE_RATE)
 
 
 def list_audio_lengths(folder_path):
     """
     This function returns a list with the duration of all the audio files in a folder.
+    Files are probed in parallel and the durations kept in a persisted index (see durations.scan_folder).
+    See dataset_qa for a full quality report of a dataset.
     """
+    from durations import scan_folder
 
     lengths = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".wav"):
-            le = get_audio_length(os.path.join(folder_path, filename))
-            # print("File {0} has duration {1}".format(filename, le))
-            if le > 10:
-                print("WARNING: File {0} has duration {1} (greater than 10 seconds)".format(filename, le))
-            lengths.append(le)
+    for filename, le in scan_folder(folder_path).items():
+        # print("File {0} has duration {1}".format(filename, le))
+        if le > 10:
+            print("WARNING: File {0} has duration {1} (greater than 10 seconds)".format(filename, le))
+        lengths.append(le)
     print("Total audio length of {0} files: {1}".format(len(lengths), sum(lengths)))
-    print("Average audio length: {0}".format(sum(lengths) / len(lengths)))
-    print("Standard deviation: {0}".format(statistics.stdev(lengths)))
+    if len(lengths) > 0:
+        print("Average audio length: {0}".format(sum(lengths) / len(lengths)))
+    if len(lengths) > 1:
+        print("Standard deviation: {0}".format(statistics.stdev(lengths)))
+    return lengths
 
 
 def get_audio_length(input_audio):
-    result = subprocess.run(
+    """
+    Duration in seconds. WAV files are measured from their RIFF header, other containers with ffprobe.
+    """
+    try:
+        info = read_wav_info(input_audio)
+        return info.n_frames / info.sample_rate
+    except ValueError:
+        pass
+    result = run_subprocess(
         ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
          input_audio], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     return float(result.stdout)
@@ -102,13 +182,44 @@ def collapse_whitespace(text):
     return re.sub(_whitespace_re, " ", text).strip()
 
 
-def multilingual_cleaners(text):
+@lru_cache(maxsize=None)
+def spanish_number(digits):
+    from num2words import num2words  # optional, only needed with expand_numbers
+    return num2words(int(digits), lang="es")
+
+
+def expand_spanish_numbers(text):
+    """
+    Writes every number of the text in Spanish words (num2words), as the training notebook expects.
+    """
+    return _number_re.sub(lambda match: spanish_number(match.group(0)), text)
+
+
+def end_sentence(text):
+    return text if not text or text[-1] in _ending_punctuation else text + "."
+
+
+@lru_cache(maxsize=65536)
+def multilingual_cleaners(text, expand_numbers=False):
     """Pipeline for multilingual text"""
     text = text.lower()
-    text = replace_symbols(text)
-    text = remove_aux_symbols(text)
-    text = collapse_whitespace(text)
-    text = text if text[-1] in ['"', "'", '.', '。', ',', '，', '!', '！', '?', '？', ':',
-                                                                '：', '”', ')', ']', '}', '、',
-                                                                ')'] else text + "."
-    return text
+    if expand_numbers:
+        text = expand_spanish_numbers(text)
+    # str.split() splits at the same unicode whitespace as the \s+ of collapse_whitespace
+    return end_sentence(" ".join(translate_symbols(text).split()))
+
+
+def clean_batch(texts, expand_numbers=False):
+    """
+    multilingual_cleaners for a list of texts. The texts are joined so lowercasing, the translation table
+    and the whitespace collapsing run once over the whole batch instead of once per text.
+    """
+    texts = list(texts)
+    joined = _batch_separator.join(texts)
+    if len(texts) == 0 or joined.count(_batch_separator) != len(texts) - 1:  # a text contains the separator
+        return [multilingual_cleaners(text, expand_numbers) for text in texts]
+    joined = joined.lower()
+    if expand_numbers:
+        joined = expand_spanish_numbers(joined)
+    joined = " ".join(translate_symbols(joined).split())
+    return [end_sentence(text.strip()) for text in joined.split(_batch_separator)]
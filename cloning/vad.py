@@ -0,0 +1,71 @@
+import numpy as np
+
+from audio_norm import to_mono
+
+BLOCK_LENGTH = 60  # seconds of audio read at once to compute the energy envelope
+
+
+def frame_energy(samples, sample_rate, frame_length=0.01):
+    """
+    Mean square energy of consecutive frames of frame_length seconds, computed block by block so
+    memory does not grow with the length of the recording (samples can be a memory map or a JoinedAudio).
+    """
+    frame = max(1, int(frame_length * sample_rate))
+    block = frame * max(1, int(BLOCK_LENGTH / frame_length))
+    energies = []
+    for i in range(0, len(samples), block):
+        x = to_mono(samples[i:i + block])
+        n = len(x) // frame
+        if n == 0:
+            continue
+        energies.append(np.mean(np.square(x[:n * frame].reshape(n, frame), dtype=np.float64), axis=1))
+    return np.concatenate(energies) if energies else np.zeros(0)
+
+
+def silence_mask(energy, margin_db=6.0, noise_percentile=10):
+    """
+    Marks as silent the frames less than margin_db above the noise floor, estimated as the
+    noise_percentile percentile of the frame energies in dB.
+    """
+    energy_db = 10 * np.log10(energy + 1e-10)
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool)
+    return energy_db < np.percentile(energy_db, noise_percentile) + margin_db
+
+
+def nearest_silent_frames(silent):
+    """
+    For every frame returns the index of the closest silent frame before (or at) it and after (or at) it,
+    -1 and len(silent) when there is none.
+    """
+    index = np.arange(len(silent))
+    previous = np.maximum.accumulate(np.where(silent, index, -1))
+    following = np.minimum.accumulate(np.where(silent, index, len(silent))[::-1])[::-1]
+    return previous, following
+
+
+def refine_cuts(starts, ends, silent, frame_length=0.01, tolerance=0.2):
+    """
+    Moves every start to the center of the closest silent frame at most tolerance seconds before it and every
+    end to the closest one at most tolerance seconds after it, so a clip only ever grows into the surrounding
+    silence and never loses the first or last word of its text. Cuts without silence in range are kept, as are
+    clips that would become empty.
+    Returns the refined (starts, ends) arrays.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(silent) == 0:
+        return starts, ends
+    previous, following = nearest_silent_frames(silent)
+
+    def frames(times):
+        return np.clip((times / frame_length).astype(np.int64), 0, len(silent) - 1)
+
+    before = previous[frames(starts)]
+    start_ok = (before >= 0) & (starts - (before + 0.5) * frame_length <= tolerance)
+    new_starts = np.where(start_ok, np.minimum((before + 0.5) * frame_length, starts), starts)
+    after = following[frames(ends)]
+    end_ok = (after < len(silent)) & ((after + 0.5) * frame_length - ends <= tolerance)
+    new_ends = np.where(end_ok, np.maximum((after + 0.5) * frame_length, ends), ends)
+    valid = new_ends > new_starts
+    return np.where(valid, new_starts, starts), np.where(valid, new_ends, ends)
@@ -1,110 +1,402 @@
 import argparse
+import csv
+import json
 import os
-import shutil
-import subprocess
-from typing import List
-import random
+import time
+from datetime import datetime
 import torch
-import datasets
 from transformers import AutoFeatureExtractor, WavLMForXVector
-from datetime import datetime
 import numpy as np
+from audio_folder import AudioFolder
+from embedding_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE, EmbeddingCache, file_hash
+from similarity_sampling import PairSampler, StratifiedEstimate, length_strata
 try:
     import tqdm
 except ImportError:
     tqdm = None
 
 # CONSTANTS
+MODEL_ID = "microsoft/wavlm-base-plus-sv"
+SAMPLING_RATE = 16000
+BATCH_SIZE = 64  # maximum clips per forward pass
+MAX_SAMPLES = 100 * SAMPLING_RATE  # maximum padded samples per forward pass (clips x longest clip)
+PERCENTILES = (5, 25, 50, 75, 95)
+CONFIDENCE = 0.95
+ROUND_PAIRS = 256  # maximum random pairs drawn between two checks of the confidence interval
+MIN_ROUND_PAIRS = 16  # pairs drawn per round until every stratum has a confidence interval
+
 
-def main(folder_path1, folder_path2, n, mode):
-    datasets.utils.logging.set_verbosity(datasets.logging.CRITICAL)
-    datasets.disable_progress_bar()
+def main(folders, n, mode, output=None, names=None, batch_size=BATCH_SIZE, cache_dir=DEFAULT_CACHE_DIR,
+         cache_size=DEFAULT_MAX_SIZE, workers=None, max_samples=MAX_SAMPLES, quantize=False, ci_width=None,
+         confidence=CONFIDENCE, strata=1, seed=None):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    feature_extractor = AutoFeatureExtractor.from_pretrained("microsoft/wavlm-base-plus-sv")
-    model = WavLMForXVector.from_pretrained("microsoft/wavlm-base-plus-sv").to(device) # type: ignore
-    similarities = []
+    feature_extractor, model, model_id = load_model(device, quantize)
+    embedder = SpeakerEmbedder(feature_extractor, model, device, batch_size, max_samples)
+    cache = EmbeddingCache(model_id, cache_dir, cache_size) if cache_dir else None
+    names = names or folders
 
-    tmp_folder_1 = generate_16k_folder(folder_path1)
-    tmp_folder_2 = generate_16k_folder(folder_path2)
-    similarities = []
-    if mode == "all":
-        similarities = get_similarities(tmp_folder_1, tmp_folder_2, feature_extractor, model, device)
-    elif mode == "random":
-        similarities = get_similarities_random(tmp_folder_1, tmp_folder_2, feature_extractor, model, device, n)
+    try:
+        results = compare_folders(folders, embedder, mode, cache, workers, n, ci_width, confidence, strata, seed)
+    finally:
+        if cache is not None:
+            cache.close()
+    if embedder.clips:
+        print(embedder.throughput())
+    print_results(results, names)
+    if output:
+        info = {"model": model_id, "mode": mode, "date": datetime.now().isoformat(timespec="seconds")}
+        if mode == "random":
+            info.update(max_comparisons=n, ci_width=ci_width, confidence=confidence, strata=strata, seed=seed)
+        write_results(results, folders, names, output, info)
+        print("Results written to", output)
 
-    #print("Similarities: ", similarities)
-    print("Average similarity: ", np.mean(similarities))
-    print("Standard deviation: ", np.std(similarities))
-    print("Max: ", np.max(similarities))
-    print("Min: ", np.min(similarities))
 
+def configure_threads(threads=None, interop_threads=None):
+    """
+    Sets the number of threads torch uses inside an operation (threads) and to run independent operations in
+    parallel (interop_threads). The inter-op pool can only be sized before torch runs anything in parallel.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        torch.set_num_interop_threads(interop_threads)
 
 
-def generate_16k_folder(folder):
-    tmp = os.path.join(os.path.abspath("tmp"), "16k-"+datetime.now().strftime("%Y%m%d-%H%M%S"))
-    shutil.copytree(folder, tmp)
-    convert_to_16k(tmp)
-    return tmp
+def load_model(device, quantize=False):
+    """
+    Returns the feature extractor, the x-vector model and the model ID used to key cached embeddings. With
+    quantize, the linear layers are dynamically quantized to int8 (CPU only), which changes the embeddings slightly,
+    so those are cached under their own ID.
+    """
+    feature_extractor = AutoFeatureExtractor.from_pretrained(MODEL_ID)
+    model = WavLMForXVector.from_pretrained(MODEL_ID).to(device) # type: ignore
+    model.eval()
+    if quantize and device.type != "cpu":
+        print("Warning: int8 quantization is only available on CPU, running the model unquantized")
+    elif quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return feature_extractor, model, MODEL_ID + "+int8"
+    return feature_extractor, model, MODEL_ID
 
 
-def convert_to_16k(folder):
-    for file in os.listdir(os.path.abspath(folder)):
-        if file.endswith(".wav"):
-            subprocess.run(["ffmpeg", "-i", os.path.join(folder, file), "-ar", "16000",
-                            os.path.join(folder, file.replace(".wav", "tmp.wav")), "-y", "-loglevel", "error",
-                            "-hide_banner"])
-            os.remove(os.path.join(folder, file))
-            os.rename(os.path.join(folder, file.replace(".wav", "tmp.wav")), os.path.join(folder, file))
+def length_batches(lengths, batch_size=BATCH_SIZE, max_samples=MAX_SAMPLES):
+    """
+    Groups clips of similar length: returns lists of indices into lengths, sorted from the shortest clips to the
+    longest, with at most batch_size clips and at most max_samples padded samples (clips x longest clip) per batch.
+    A clip longer than max_samples gets a batch of its own.
+    """
+    batches, batch = [], []
+    for i in np.argsort(lengths, kind="stable"):
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * lengths[i] > max_samples):
+            batches.append(batch)
+            batch = []
+        batch.append(int(i))
+    if batch:
+        batches.append(batch)
+    return batches
 
 
-def get_similarities_random(folder1, folder2, feature_extractor, model, device, number_comparisons) -> List[float]:
-    dataset1 = datasets.load_dataset("audiofolder", data_dir=folder1)
-    dataset2 = datasets.load_dataset("audiofolder", data_dir=folder2)
-    sampling_rate = dataset1["train"]["audio"][0]["sampling_rate"] # type: ignore
+class SpeakerEmbedder:
+    """
+    Runs the x-vector model over clips in batches of similar length, so little of the compute goes to padding,
+    and keeps track of the throughput.
+    """
 
-    similarities = []
-    for _ in range(number_comparisons):
-        i = random.randint(0, len(dataset1["train"]["audio"]) - 1) # type: ignore
-        j = random.randint(0, len(dataset2["train"]["audio"]) - 1) # type: ignore
-        # Extract features
-        inputs = feature_extractor(
-            [dataset1["train"]["audio"][i]["array"], dataset2["train"]["audio"][j]["array"]], # type: ignore
-            sampling_rate=sampling_rate, return_tensors="pt", padding=True
-        ).to(device)
-        # Get embeddings
+    def __init__(self, feature_extractor, model, device, batch_size=BATCH_SIZE, max_samples=MAX_SAMPLES):
+        self.feature_extractor = feature_extractor
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+        self.clips = 0
+        self.audio_seconds = 0.0
+        self.seconds = 0.0
+
+    def embed_batch(self, arrays) -> np.ndarray:
+        inputs = self.feature_extractor(arrays, sampling_rate=SAMPLING_RATE, return_tensors="pt",
+                                        padding=True).to(self.device)
         with torch.no_grad():
-            embeddings = model(**inputs).embeddings
-        embeddings = torch.nn.functional.normalize(embeddings, dim=-1).cpu()
-        # Calculate similarity
-        cosine_sim = torch.nn.CosineSimilarity(dim=-1)
-        similarity = cosine_sim(embeddings[0], embeddings[1])
-        similarities.append(similarity.item())
-    return similarities
-
-def get_similarities(fakefiles, realfiles, feature_extractor, model, device) -> List[float]:
-    # Create dataset with audiofolder mode, pass the folder dir and make it silent
-    fake_dataset = datasets.load_dataset("audiofolder", data_dir=fakefiles)
-    real_dataset = datasets.load_dataset("audiofolder", data_dir=realfiles)
-    sampling_rate = fake_dataset["train"]["audio"][0]["sampling_rate"] # type: ignore
-
-    #Now i want to get similarity between each fake and real file
+            batch = self.model(**inputs).embeddings
+        return torch.nn.functional.normalize(batch, dim=-1).cpu().numpy()
+
+    def embed(self, clips: AudioFolder, indices=None) -> np.ndarray:
+        """
+        Embeds the clips of indices (every clip by default) and returns their L2-normalized embeddings, in the
+        order of indices, as an (n clips, embedding size) array, so cosine similarities are plain dot products.
+        Clips are decoded in batch order while the previous batch runs and only the current batch is held in memory.
+        """
+        indices = np.arange(len(clips)) if indices is None else np.asarray(indices, dtype=np.int64)
+        batches = length_batches(clips.lengths()[indices], self.batch_size, self.max_samples)
+        stream = clips.stream(indices[[i for batch in batches for i in batch]])
+        embeddings = [None] * len(indices)
+        start = time.perf_counter()
+        for batch in batches:
+            arrays = [next(stream)[1] for _ in batch]
+            for i, embedding in zip(batch, self.embed_batch(arrays)):
+                embeddings[i] = embedding
+            self.audio_seconds += sum(len(array) for array in arrays) / SAMPLING_RATE
+        stream.close()
+        self.seconds += time.perf_counter() - start
+        self.clips += len(indices)
+        return np.stack(embeddings)
+
+    def throughput(self):
+        return "Embedded {0} clips ({1:.1f} s of audio) in {2:.1f} s: {3:.1f} clips/s, {4:.1f}x real time".format(
+            self.clips, self.audio_seconds, self.seconds, self.clips / max(self.seconds, 1e-9),
+            self.audio_seconds / max(self.seconds, 1e-9))
+
+
+class FolderEmbeddings:
+    """
+    Embeddings of the wav files of a folder (in file name order), computed the first time they are needed. Clips
+    are decoded and resampled to 16 kHz on demand (see AudioFolder). With a cache, clips whose content was already
+    embedded are read from it and only the new ones are decoded, embedded and added to the cache.
+    """
+
+    def __init__(self, folder, embedder: SpeakerEmbedder, cache: EmbeddingCache = None, workers=None):
+        self.folder = folder
+        self.clips = AudioFolder(folder, SAMPLING_RATE, workers=workers)
+        self.embedder = embedder
+        self.cache = cache
+        self.keys = [None] * len(self.clips)
+        self.embeddings = None  # allocated once the embedding size is known
+        self.done = np.zeros(len(self.clips), dtype=bool)
+        self.cache_hits = 0
+
+    def __len__(self):
+        return len(self.clips)
+
+    def _store(self, indices, embeddings):
+        if self.embeddings is None:
+            self.embeddings = np.empty((len(self.clips), embeddings.shape[1]), dtype=np.float32)
+        self.embeddings[indices] = embeddings
+        self.done[indices] = True
+
+    def get(self, indices=None) -> np.ndarray:
+        """
+        Embeddings of the clips of indices (every clip by default), embedding the ones not computed yet.
+        """
+        indices = np.arange(len(self.clips)) if indices is None else np.asarray(indices, dtype=np.int64)
+        missing = np.unique(indices[~self.done[indices]])
+        if len(missing) and self.cache is not None:
+            for i in missing:
+                self.keys[i] = self.keys[i] or file_hash(self.clips.paths[i])
+            found, cached = self.cache.get([self.keys[i] for i in missing])
+            if found.any():
+                self._store(missing[found], cached)
+                self.cache_hits += int(found.sum())
+            missing = missing[~found]
+        if len(missing):
+            embeddings = self.embedder.embed(self.clips, missing)
+            if self.cache is not None:
+                self.cache.put([self.keys[i] for i in missing], embeddings)
+            self._store(missing, embeddings)
+        return self.embeddings[indices] if self.embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def embed_folder(folder, embedder: SpeakerEmbedder, cache: EmbeddingCache = None, workers=None):
+    """
+    Embeddings of every wav file of folder, in file name order (see FolderEmbeddings).
+    """
+    embeddings = FolderEmbeddings(folder, embedder, cache, workers)
+    result = embeddings.get()
+    if cache is not None:
+        print("{0} of {1} clips of {2} found in the embedding cache".format(embeddings.cache_hits, len(embeddings),
+                                                                          folder))
+    return result
+
+
+def embed_folders(folder1, folder2, embedder: SpeakerEmbedder, cache: EmbeddingCache = None, workers=None):
+    """
+    Embeddings of two folders. A folder compared with itself is only embedded once.
+    """
+    embeddings1 = embed_folder(folder1, embedder, cache, workers)
+    if os.path.abspath(folder1) == os.path.abspath(folder2):
+        return embeddings1, embeddings1
+    return embeddings1, embed_folder(folder2, embedder, cache, workers)
+
+
+def off_diagonal(similarities):
+    """
+    Entries of a square similarity matrix of a folder with itself, without the pairs of a clip with itself.
+    """
+    return similarities[~np.eye(len(similarities), dtype=bool)]
+
+
+def similarity_stats(similarities) -> dict:
+    similarities = np.asarray(similarities)
+    if len(similarities) == 0:  # a folder of one clip compared with itself
+        return dict({"count": 0}, **{stat: float("nan") for stat in ["mean", "std", "max", "min"]},
+                    **{"p{0}".format(p): float("nan") for p in PERCENTILES})
+    stats = {"count": len(similarities), "mean": float(np.mean(similarities)), "std": float(np.std(similarities)),
+             "max": float(np.max(similarities)), "min": float(np.min(similarities))}
+    for p, value in zip(PERCENTILES, np.percentile(similarities, PERCENTILES)):
+        stats["p{0}".format(p)] = float(value)
+    return stats
+
+
+def next_round(estimate: StratifiedEstimate, confidence, ci_width, n_strata):
+    """
+    Pairs to draw before the next check of the confidence interval. Without a target width, ROUND_PAIRS. With one,
+    half of the comparisons the current interval suggests are still missing (its width shrinks with the square root
+    of the comparisons, but the variance estimate is noisy), at least one and at most ROUND_PAIRS, so rounds shrink
+    as the interval approaches the target and the stop lands within a few comparisons of it.
+    """
+    if ci_width is None:
+        return ROUND_PAIRS
+    low, high = estimate.interval(confidence)
+    if not np.isfinite(high - low):
+        return min(ROUND_PAIRS, max(MIN_ROUND_PAIRS, 2 * n_strata))
+    missing = estimate.n * ((high - low) / ci_width) ** 2 - estimate.n
+    return int(np.clip(np.ceil(missing / 2), 1, ROUND_PAIRS))
+
+
+def sample_similarities(embeddings1: FolderEmbeddings, embeddings2: FolderEmbeddings, number_comparisons=None,
+                        ci_width=None, confidence=CONFIDENCE, strata=1, seed=None):
+    """
+    Similarities of random pairs of clips, drawn without replacement in rounds (see next_round), and the
+    estimate of the mean similarity of all the pairs with its confidence interval (see StratifiedEstimate).
+    With strata > 1 the clips of each folder are split in that many length groups and every combination of groups
+    gets its share of the pairs. Sampling stops after number_comparisons pairs (all of them by default) or, with
+    ci_width, as soon as the confidence interval is narrower than ci_width. Only the clips of the drawn pairs are
+    embedded, so stopping early also saves forward passes. A folder compared with itself (the same
+    FolderEmbeddings twice) never pairs a clip with itself.
+    Returns (similarities, estimate report).
+    """
+    strata1 = length_strata(embeddings1.clips.lengths() if strata > 1 else np.zeros(len(embeddings1)), strata)
+    strata2 = length_strata(embeddings2.clips.lengths() if strata > 1 else np.zeros(len(embeddings2)), strata)
+    sampler = PairSampler(strata1, strata2, np.random.default_rng(seed), distinct=embeddings1 is embeddings2)
+    estimate = StratifiedEstimate(sampler)
+    limit = number_comparisons or int(sampler.sizes.sum())
     similarities = []
-    number_comparisons = len(fake_dataset["train"]["audio"]) * len(real_dataset["train"]["audio"]) # type: ignore
-    print(f"Comparing {number_comparisons} pairs of files")
-    for i in range(len(fake_dataset["train"]["audio"])): # type: ignore
-        for j in range(len(real_dataset["train"]["audio"])): # type: ignore
-            inputs = feature_extractor(
-                [fake_dataset["train"]["audio"][i]["array"], real_dataset["train"]["audio"][j]["array"]], # type: ignore
-                sampling_rate=sampling_rate, return_tensors="pt", padding=True
-            ).to(device)
-            with torch.no_grad():
-                embeddings = model(**inputs).embeddings
-            embeddings = torch.nn.functional.normalize(embeddings, dim=-1).cpu()
-            # the resulting embeddings can be used for cosine similarity-based retrieval
-            cosine_sim = torch.nn.CosineSimilarity(dim=-1)
-            similarity = cosine_sim(embeddings[0], embeddings[1])
-            similarities.append(similarity.item())
-    return similarities
+    while estimate.n < limit and not sampler.exhausted():
+        i, j, h = sampler.draw(min(next_round(estimate, confidence, ci_width, len(sampler.sizes)), limit - estimate.n))
+        values = np.einsum("ij,ij->i", embeddings1.get(i), embeddings2.get(j))
+        similarities.append(values)
+        estimate.update(values, h)
+        if ci_width is not None and np.diff(estimate.interval(confidence))[0] <= ci_width:
+            break
+    similarities = np.concatenate(similarities) if similarities else np.zeros(0, dtype=np.float32)
+    return similarities, estimate.report(confidence)
+
+
+def get_similarities_random(folder1, folder2, embedder: SpeakerEmbedder, number_comparisons=None,
+                            cache: EmbeddingCache = None, workers=None, ci_width=None, confidence=CONFIDENCE,
+                            strata=1, seed=None):
+    """
+    Random pairs of clips of two folders, see sample_similarities. Returns (similarities, estimate report).
+    """
+    embeddings1 = FolderEmbeddings(folder1, embedder, cache, workers)
+    same = os.path.abspath(folder1) == os.path.abspath(folder2)
+    embeddings2 = embeddings1 if same else FolderEmbeddings(folder2, embedder, cache, workers)
+    return sample_similarities(embeddings1, embeddings2, number_comparisons, ci_width, confidence, strata, seed)
+
+
+def get_similarities(fakefiles, realfiles, embedder: SpeakerEmbedder, cache: EmbeddingCache = None,
+                     workers=None) -> np.ndarray:
+    """
+    Similarity between each fake and real file: every clip is embedded once (N + M forward passes instead of
+    N x M) and all the cosine similarities come from one product of the normalized embedding matrices. A folder
+    compared with itself leaves out the pairs of a clip with itself.
+    """
+    fake_embeddings, real_embeddings = embed_folders(fakefiles, realfiles, embedder, cache, workers)
+    if os.path.abspath(fakefiles) == os.path.abspath(realfiles):
+        print(f"Comparing {len(fake_embeddings) * (len(fake_embeddings) - 1)} pairs of files")
+        return off_diagonal(fake_embeddings @ fake_embeddings.T)
+    print(f"Comparing {len(fake_embeddings) * len(real_embeddings)} pairs of files")
+    return (fake_embeddings @ real_embeddings.T).ravel()
+
+
+def compare_folders(folders, embedder: SpeakerEmbedder, mode="all", cache: EmbeddingCache = None, workers=None,
+                    number_comparisons=None, ci_width=None, confidence=CONFIDENCE, strata=1, seed=None) -> list:
+    """
+    Compares every folder with every folder (itself included), embedding each folder once. Pairs are symmetric,
+    so only the upper triangle is computed, and a folder compared with itself leaves out the pairs of a clip with
+    itself. Returns one dict per ordered pair (a, b) with the indices of both folders, the similarity_stats of
+    their clips and, in mode random, the estimate of the mean with its CI.
+    """
+    embeddings = dict()  # by absolute path, a folder passed twice is embedded once
+    for folder in folders:
+        if os.path.abspath(folder) not in embeddings:
+            embeddings[os.path.abspath(folder)] = FolderEmbeddings(folder, embedder, cache, workers)
+    results = dict()
+    for a, folder_a in enumerate(folders):
+        for b in range(a, len(folders)):
+            embeddings_a, embeddings_b = embeddings[os.path.abspath(folder_a)], embeddings[os.path.abspath(folders[b])]
+            entry = {"a": a, "b": b}
+            if mode == "all" and embeddings_a is embeddings_b:
+                similarities = off_diagonal(embeddings_a.get() @ embeddings_a.get().T)
+            elif mode == "all":
+                similarities = (embeddings_a.get() @ embeddings_b.get().T).ravel()
+            else:
+                similarities, entry["estimate"] = sample_similarities(embeddings_a, embeddings_b, number_comparisons,
+                                                                      ci_width, confidence, strata, seed)
+            entry.update(similarity_stats(similarities))
+            results[a, b] = entry
+            results[b, a] = dict(entry, a=b, b=a)
+    if cache is not None:
+        for folder_embeddings in embeddings.values():
+            print("{0} of {1} clips of {2} found in the embedding cache".format(
+                folder_embeddings.cache_hits, len(folder_embeddings), folder_embeddings.folder))
+    return [results[a, b] for a in range(len(folders)) for b in range(len(folders))]
+
+
+def finite(value):
+    return value if np.isfinite(value) else None
+
+
+def write_results(results, folders, names, path, info=None):
+    """
+    Writes the comparison of compare_folders. A .csv path gets one row per pair of folders; any other path gets a
+    JSON file with the folders and, for every statistic, the N x N matrix (row a, column b).
+    """
+    stats = ["count", "mean", "std", "min", "max"] + ["p{0}".format(p) for p in PERCENTILES]
+    estimates = ["mean", "ci_low", "ci_high", "ci_width", "comparisons", "pairs"]
+    if path.lower().endswith(".csv"):
+        with open(path, "w", encoding="utf8", newline="") as f:
+            writer = csv.writer(f)
+            has_estimate = any("estimate" in entry for entry in results)
+            writer.writerow(["a", "b"] + stats + (["estimate_" + key for key in estimates] if has_estimate else []))
+            for entry in results:
+                row = [names[entry["a"]], names[entry["b"]]] + [finite(entry[stat]) for stat in stats]
+                if has_estimate:
+                    row += [finite(entry["estimate"][key]) for key in estimates]
+                writer.writerow(row)
+        return
+    n = len(folders)
+    matrices = {stat: [[finite(results[a * n + b][stat]) for b in range(n)] for a in range(n)] for stat in stats}
+    if any("estimate" in entry for entry in results):
+        for key in estimates:
+            matrices["estimate_" + key] = [[finite(results[a * n + b]["estimate"][key]) for b in range(n)]
+                                           for a in range(n)]
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(dict(info or dict(), names=names, folders=[os.path.abspath(folder) for folder in folders],
+                       matrices=matrices), f, indent=4, ensure_ascii=False)
+
+
+def print_results(results, names):
+    for entry in results:
+        if entry["a"] > entry["b"]:
+            continue
+        print("{0} vs {1} ({2} comparisons)".format(names[entry["a"]], names[entry["b"]], entry["count"]))
+        print("    Average similarity: ", entry["mean"])
+        print("    Standard deviation: ", entry["std"])
+        print("    Max: ", entry["max"])
+        print("    Min: ", entry["min"])
+        print("    Percentiles: ", ", ".join("p{0}={1}".format(p, entry["p{0}".format(p)]) for p in PERCENTILES))
+        estimate = entry.get("estimate")
+        if estimate is not None:
+            print("    Estimated mean similarity: {0} ({1:.0%} CI [{2}, {3}], width {4}, {5} of {6} pairs "
+                  "compared)".format(estimate["mean"], estimate["confidence"], estimate["ci_low"],
+                                     estimate["ci_high"], estimate["ci_width"], estimate["comparisons"],
+                                     estimate["pairs"]))
+    width = max(len(name) for name in names)
+    column = max(8, width)
+    print("Mean similarity:")
+    print(" " * width + "".join(" {0:>{1}}".format(name, column) for name in names))
+    for a, name in enumerate(names):
+        print("{0:<{1}}".format(name, width) + "".join(" {0:{1}.4f}".format(results[a * len(names) + b]["mean"], column)
+                                                         for b in range(len(names))))
 
 
 def force_cudnn_initialization():
@@ -115,31 +407,66 @@ def force_cudnn_initialization():
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description='Speaker Similarity Validation')
     argparser.add_argument('-p', '--paths', type=str,
-                        help='Path to the folders to compare (1 or 2)', required=True, nargs="+")
-    argparser.add_argument('-n', '--n', type=int, default=10, help='Number of random comparisons to make. Only works with mode random.', required=False)
+                        help='Path to the folders to compare. Every folder is compared with every folder', required=True,
+                        nargs="+")
+    argparser.add_argument('--names', type=str, default=None, nargs="+", required=False,
+                           help='Name of every folder in the results, default is the path')
+    argparser.add_argument('-o', '--output', type=str, default=None, required=False,
+                           help='Write the results to this file: one row per pair of folders if it ends in .csv, '
+                                'otherwise JSON with the N x N matrix of every statistic')
+    argparser.add_argument('-n', '--n', type=int, default=None, help='Maximum number of random comparisons to make. Only works with mode random. \
+                           Default is 10 (at least two per stratum), or every pair when --ci_width is given.', required=False)
+    argparser.add_argument('--ci_width', type=float, default=None, required=False,
+                           help='Mode random: stop once the confidence interval of the mean similarity is narrower '
+                                'than this. The interval is checked after every round of pairs, and rounds shrink '
+                                'as the interval approaches the target, so the stop overshoots by a few comparisons '
+                                'at most')
+    argparser.add_argument('--confidence', type=float, default=CONFIDENCE, required=False,
+                           help='Confidence level of the interval. Default is {0}.'.format(CONFIDENCE))
+    argparser.add_argument('--strata', type=int, default=1, required=False,
+                           help='Mode random: split the clips of each folder in this many length groups and draw '
+                                'pairs from every combination of groups. Default is 1 (no stratification).')
+    argparser.add_argument('--seed', type=int, default=None, required=False, help='Seed of the random pairs')
 
+    argparser.add_argument('-b', '--batch_size', type=int, default=BATCH_SIZE, required=False,
+                           help='Maximum number of clips per forward pass. Default is {0}.'.format(BATCH_SIZE))
+    argparser.add_argument('--max_samples', type=int, default=MAX_SAMPLES, required=False,
+                           help='Maximum padded samples per forward pass (clips x longest clip at 16 kHz). Clips are '
+                                'sorted by length to fill batches. Default is {0}.'.format(MAX_SAMPLES))
+    argparser.add_argument('-t', '--threads', type=int, default=None, required=False,
+                           help='Threads used by torch inside each operation. Default is the torch default.')
+    argparser.add_argument('--interop_threads', type=int, default=None, required=False,
+                           help='Threads used by torch to run independent operations. Default is the torch default.')
+    argparser.add_argument('-q', '--quantize', action='store_true',
+                           help='Quantize the linear layers of the model to int8 (CPU only)')
     argparser.add_argument('-m', '--mode', type=str, default="random", help='Mode to compare the folders. Options: random, all. When selecting \
                            random, parameter number of comparisons (-n) is used.', required=False)
+    argparser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, required=False,
+                           help='Directory of the embedding cache. Default is {0}.'.format(DEFAULT_CACHE_DIR))
+    argparser.add_argument('--cache_size', type=float, default=DEFAULT_MAX_SIZE / 1024 ** 2, required=False,
+                           help='Maximum size of the embedding cache in MB, least recently used embeddings are '
+                                'removed first. Default is {0:.0f}.'.format(DEFAULT_MAX_SIZE / 1024 ** 2))
+    argparser.add_argument('--no_cache', action='store_true', help='Embed every clip without using the cache')
+    argparser.add_argument('-w', '--workers', type=int, default=None, required=False,
+                           help='Threads decoding and resampling the clips. Default is the number of CPUs.')
     args = argparser.parse_args()
 
-    shutil.rmtree(os.path.abspath("tmp"), ignore_errors=True)
-
-    if len(args.paths) > 2:
-        print(f"Error: only one or two folders can be passed, {len(args.paths)} were passed.")
-        exit(1)
-    elif len(args.paths) == 1:
+    if len(args.paths) == 1:
         print("Warning: only one folder was passed. Comparing folder with itself")
-        args.paths.append(args.paths[0])
-    # Check that folder exists and is a directory
-    if not os.path.isdir(os.path.normpath(args.paths[0])):
-        print(f"Error: {args.paths[0]} folder does not exist")
+    if args.names is not None and len(args.names) != len(args.paths):
+        print(f"Error: {len(args.names)} names were passed for {len(args.paths)} folders")
         exit(1)
-    if not os.path.isdir(os.path.normpath(args.paths[1])):
-        print(f"Error: {args.paths[1]} folder does not exist")
-        exit(1)
-    path1 = os.path.abspath(args.paths[0])
-    path2 = os.path.abspath(args.paths[1])
-
+    # Check that the folders exist and are directories
+    for path in args.paths:
+        if not os.path.isdir(os.path.normpath(path)):
+            print(f"Error: {path} folder does not exist")
+            exit(1)
 
-    force_cudnn_initialization()
-    main(args.paths[0], args.paths[1], args.n, args.mode)
+    if args.n is None and args.ci_width is None:
+        args.n = max(10, 2 * args.strata ** 2)  # the CI needs two comparisons per stratum
+    configure_threads(args.threads, args.interop_threads)
+    if torch.cuda.is_available():
+        force_cudnn_initialization()
+    main(args.paths, args.n, args.mode, args.output, args.names, args.batch_size,
+         None if args.no_cache else args.cache_dir, int(args.cache_size * 1024 ** 2), args.workers,
+         args.max_samples, args.quantize, args.ci_width, args.confidence, args.strata, args.seed)